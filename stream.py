@@ -1,25 +1,204 @@
+import logging
+import queue
+import threading
+import time
 import uuid
-from typing import Dict, Callable, Optional
+from collections import deque
+from typing import Any, Dict, Callable, Iterator, Optional, Union
 from confluent_kafka import Consumer, KafkaError, KafkaException
+from google.protobuf.internal import api_implementation
 from google.protobuf.message import DecodeError
 import config
 
 from evm import dex_pool_block_message_pb2
-from utils.protobuf_utils import protobuf_to_dict, convert_hex_to_int
+from utils.protobuf_utils import protobuf_to_dict_int
+
+logger = logging.getLogger(__name__)
+
+
+# Parsing every block message with the pure-Python protobuf runtime is 25-250x
+# slower than the native (upb/cpp) backends, so make a silent fallback visible.
+if api_implementation.Type() not in ('upb', 'cpp'):
+    print(f"WARNING: protobuf is using the '{api_implementation.Type()}' implementation; "
+          f"install protobuf>=4.21 for the native upb parser")
+
+# Parts of each block message the trading strategy reads (see utils.protobuf_utils.
+# protobuf_to_dict_int for the spec format). Signatures, calldata, blooms and
+# other unused fields are never converted to Python objects.
+DEX_POOL_FIELDS = {
+    'Header': {'Number': None, 'Time': None, 'Hash': None, 'ParentHash': None, 'BaseFee': None},
+    'PoolEvents': {
+        'TransactionHeader': {'Hash': None, 'GasPrice': None, 'GasFeeCap': None, 'GasTipCap': None},
+        'Dex': None,
+        'Liquidity': None,
+        'PoolPriceTable': None,
+        'Pool': None,
+    },
+}
+
+# librdkafka fetch settings tuned for throughput: brokers coalesce responses into
+# large fetches instead of answering every small poll with a separate round-trip.
+DEFAULT_CONSUMER_TUNING = {
+    'fetch.min.bytes': 65536,
+    'fetch.wait.max.ms': 200,
+    'fetch.message.max.bytes': 4 * 1024 * 1024,
+    'queued.max.messages.kbytes': 262144,
+    'queued.min.messages': 100000,
+    'fetch.queue.backoff.ms': 100,
+    # Larger socket buffers let the kernel absorb a whole compressed fetch response
+    'socket.receive.buffer.bytes': 4 * 1024 * 1024,
+    'socket.send.buffer.bytes': 1024 * 1024,
+    # Must stay above the largest fetch AdaptiveFetchSizer can grow to
+    'receive.message.max.bytes': 128 * 1024 * 1024,
+}
+
+
+class AdaptiveFetchSizer:
+    """Adapts librdkafka fetch sizes to how fast batches are processed."""
+    
+    def __init__(
+        self,
+        message_max_bytes: int,
+        queue_max_kbytes: int,
+        min_message_max_bytes: int = 1024 * 1024,
+        max_message_max_bytes: int = 64 * 1024 * 1024,
+        min_queue_max_kbytes: int = 65536,
+        max_queue_max_kbytes: int = 524288,
+        grow_factor: float = 1.5,
+        shrink_factor: float = 0.75,
+        grow_ratio: float = 0.5,
+        shrink_ratio: float = 2.0,
+        grow_windows: int = 3
+    ):
+        """
+        Initialize adaptive fetch sizer.
+        
+        Args:
+            message_max_bytes: Starting fetch.message.max.bytes
+            queue_max_kbytes: Starting queued.max.messages.kbytes
+            min_message_max_bytes: Lower bound for fetch.message.max.bytes
+            max_message_max_bytes: Upper bound for fetch.message.max.bytes
+            min_queue_max_kbytes: Lower bound for queued.max.messages.kbytes
+            max_queue_max_kbytes: Upper bound for queued.max.messages.kbytes (per-partition
+                memory librdkafka may buffer; far below its 2097151 maximum)
+            grow_factor: Multiplier applied when processing keeps up
+            shrink_factor: Multiplier applied when processing falls behind
+            grow_ratio: Process/fetch ratio below which a full batch counts towards growing
+            shrink_ratio: Process/fetch ratio above which sizes shrink immediately
+            grow_windows: Consecutive fast full batches required before growing
+        """
+        self.message_max_bytes = message_max_bytes
+        self.queue_max_kbytes = queue_max_kbytes
+        self.min_message_max_bytes = min_message_max_bytes
+        self.max_message_max_bytes = max_message_max_bytes
+        self.min_queue_max_kbytes = min_queue_max_kbytes
+        self.max_queue_max_kbytes = max_queue_max_kbytes
+        self.grow_factor = grow_factor
+        self.shrink_factor = shrink_factor
+        self.grow_ratio = grow_ratio
+        self.shrink_ratio = shrink_ratio
+        self.grow_windows = grow_windows
+        self._fast_windows = 0
+    
+    def record(self, t_fetch: float, t_process: float, full: bool) -> Optional[Dict]:
+        """
+        Record timings for one batch.
+        
+        Only full batches count towards growing: a partial batch means consume()
+        waited out its timeout on a quiet stream, so its long fetch time says
+        nothing about fetches being too small.
+        
+        Args:
+            t_fetch: Seconds spent waiting in consume()
+            t_process: Seconds spent parsing and processing the batch
+            full: Whether consume() returned as many messages as were asked for
+            
+        Returns:
+            New consumer settings if the fetch sizes changed, None otherwise
+        """
+        ratio = t_process / max(t_fetch, 1e-6)
+        
+        if ratio > self.shrink_ratio:
+            self._fast_windows = 0
+            return self._resize(self.shrink_factor)
+        
+        if full and ratio < self.grow_ratio:
+            self._fast_windows += 1
+            if self._fast_windows >= self.grow_windows:
+                self._fast_windows = 0
+                return self._resize(self.grow_factor)
+        else:
+            self._fast_windows = 0
+        
+        return None
+    
+    def _resize(self, factor: float) -> Optional[Dict]:
+        """Scale both fetch sizes by factor within bounds; None if nothing changed."""
+        message_max_bytes = min(max(int(self.message_max_bytes * factor), self.min_message_max_bytes), self.max_message_max_bytes)
+        queue_max_kbytes = min(max(int(self.queue_max_kbytes * factor), self.min_queue_max_kbytes), self.max_queue_max_kbytes)
+        
+        if message_max_bytes == self.message_max_bytes and queue_max_kbytes == self.queue_max_kbytes:
+            return None
+        
+        self.message_max_bytes = message_max_bytes
+        self.queue_max_kbytes = queue_max_kbytes
+        return {
+            'fetch.message.max.bytes': message_max_bytes,
+            'queued.max.messages.kbytes': queue_max_kbytes,
+        }
+
+
+class ParsedBlock:
+    """
+    Parsed block message holding the decoded Header and PoolEvents.
+    
+    Supports the dict reads the strategy uses (get, [], in). Instances are
+    reused: hand one back with BitqueryStream.recycle once it has been processed.
+    """
+    
+    __slots__ = ('Header', 'PoolEvents')
+    
+    def __init__(self):
+        self.Header: Optional[Dict] = None
+        self.PoolEvents: Optional[list] = None
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in ParsedBlock.__slots__ else None
+        return default if value is None else value
+    
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+    
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
 
 
 class BitqueryStream:
     """Bitquery Kafka stream consumer for DEX pool events."""
     
-    def __init__(self, topic: str = 'eth.dexpools.proto', group_id_suffix: Optional[str] = None):
+    def __init__(
+        self,
+        topic: str = 'eth.dexpools.proto',
+        group_id_suffix: Optional[str] = None,
+        tuning: Optional[Dict] = None,
+        adaptive_fetch: bool = True,
+        fields: Optional[Dict] = DEX_POOL_FIELDS
+    ):
         """
         Initialize Bitquery stream consumer.
         
         Args:
             topic: Kafka topic to subscribe to
             group_id_suffix: Optional suffix for consumer group ID
+            tuning: Optional librdkafka settings overriding DEFAULT_CONSUMER_TUNING
+            adaptive_fetch: Whether to resize fetches based on processing speed
+            fields: Field spec of the message parts to decode (None decodes everything)
         """
         self.topic = topic
+        self.fields = fields
         group_id_suffix = group_id_suffix or uuid.uuid4().hex
         
         conf = {
@@ -33,76 +212,248 @@ class BitqueryStream:
             'sasl.password': config.eth_password,
             'auto.offset.reset': 'latest',
         }
+        conf.update(DEFAULT_CONSUMER_TUNING)
+        if tuning:
+            conf.update(tuning)
         
+        self.conf = conf
         self.consumer = Consumer(conf)
         self.consumer.subscribe([topic])
+        
+        # One reusable protobuf message per parsing thread (see parse_message)
+        self._local = threading.local()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        # Serializes consumer rebuilds with close(), so no consumer is created after closing
+        self._consumer_lock = threading.Lock()
+        
+        # Recycled ParsedBlock containers; only usable when the field spec decodes
+        # nothing beyond the ParsedBlock slots
+        self._block_pool: deque = deque(maxlen=64)
+        self._pooled = fields is not None and set(fields) <= set(ParsedBlock.__slots__)
+        
+        self.fetch_sizer = None
+        if adaptive_fetch:
+            self.fetch_sizer = AdaptiveFetchSizer(
+                message_max_bytes=conf['fetch.message.max.bytes'],
+                queue_max_kbytes=conf['queued.max.messages.kbytes']
+            )
+    
+    def _rebuild_consumer(self, settings: Dict):
+        """
+        Recreate the consumer with updated settings.
+        
+        librdkafka cannot change fetch sizes on a live consumer. The same
+        group.id is reused so committed offsets survive the rebuild.
+        
+        Args:
+            settings: librdkafka settings to apply
+        """
+        with self._consumer_lock:
+            if self._closed:
+                return
+            self.conf.update(settings)
+            self.consumer.close()
+            self.consumer = Consumer(self.conf)
+            self.consumer.subscribe([self.topic])
+        logger.info("[STREAM] Resized fetches: fetch.message.max.bytes=%s, queued.max.messages.kbytes=%s",
+                    self.conf['fetch.message.max.bytes'], self.conf['queued.max.messages.kbytes'])
     
-    def parse_message(self, buffer: bytes) -> Optional[Dict]:
+    def _message(self):
+        """Get this thread's reusable DexPoolBlockMessage instance."""
+        msg = getattr(self._local, 'msg', None)
+        if msg is None:
+            msg = dex_pool_block_message_pb2.DexPoolBlockMessage()
+            self._local.msg = msg
+        return msg
+    
+    def recycle(self, block: Union[ParsedBlock, Dict]):
+        """
+        Return a processed ParsedBlock so a later parse_message can refill it.
+        
+        The block's Header and PoolEvents are dropped from it (the objects themselves
+        are left untouched, so references taken while processing stay valid).
+        Dictionaries are ignored.
+        
+        Args:
+            block: Block previously returned by parse_message
         """
-        Parse a Kafka message buffer into a dictionary.
+        if isinstance(block, ParsedBlock):
+            block.Header = None
+            block.PoolEvents = None
+            self._block_pool.append(block)
+    
+    def parse_message(self, buffer: bytes) -> Optional[Union[ParsedBlock, Dict]]:
+        """
+        Parse a Kafka message buffer into a ParsedBlock (or a dictionary).
+        
+        The protobuf message is reused across calls on the same thread. This is
+        only safe because it is fully converted before returning, so no
+        reference to it escapes this method.
+        
+        A pooled ParsedBlock is returned when the field spec only covers Header
+        and PoolEvents; otherwise the full dictionary is returned.
         
         Args:
             buffer: Raw message bytes from Kafka
             
         Returns:
-            Parsed dictionary or None if parsing fails
+            Parsed block or None if the buffer is empty or not a valid message
         """
+        if not buffer:
+            return None
+        
+        # Parse straight from the bytes returned by msg.value(): upb reads the
+        # buffer in place, and wrapping it in a memoryview only adds overhead.
+        price_feed = self._message()
+        price_feed.Clear()
         try:
-            if not buffer:
-                return None
-            
-            price_feed = dex_pool_block_message_pb2.DexPoolBlockMessage()
-            price_feed.ParseFromString(buffer)
+            price_feed.MergeFromString(buffer)
+        except DecodeError:
+            return None
+        
+        if not self._pooled:
+            return protobuf_to_dict_int(price_feed, self.fields)
+        
+        fields = self.fields
+        try:
+            block = self._block_pool.pop()
+        except IndexError:
+            block = ParsedBlock()
+        if 'Header' in fields and price_feed.HasField('Header'):
+            block.Header = protobuf_to_dict_int(price_feed.Header, fields['Header'])
+        if 'PoolEvents' in fields and price_feed.PoolEvents:
+            event_fields = fields['PoolEvents']
+            block.PoolEvents = [protobuf_to_dict_int(event, event_fields) for event in price_feed.PoolEvents]
+        return block
+    
+    def poll_batch(self, max_messages: int = 500, timeout: float = 1.0) -> Iterator[Union[ParsedBlock, Dict]]:
+        """
+        Fetch a batch of messages from Kafka and yield the parsed ones.
+        
+        A single consume() call replaces one poll() round-trip per message.
+        
+        Args:
+            max_messages: Maximum number of messages to fetch in one call
+            timeout: Consume timeout in seconds
             
-            data_dict = protobuf_to_dict(price_feed, encoding='hex')
-            data_dict = convert_hex_to_int(data_dict)
+        Yields:
+            Parsed blocks (messages that fail to parse are skipped)
+        """
+        fetch_start = time.monotonic()
+        msgs = self.consumer.consume(num_messages=max_messages, timeout=timeout)
+        process_start = time.monotonic()
+        
+        for msg in msgs:
+            error = msg.error()
+            if error:
+                if error.code() == KafkaError._PARTITION_EOF:
+                    continue
+                raise KafkaException(error)
             
-            return data_dict
-        except (DecodeError, Exception):
-            return None
+            data_dict = self.parse_message(msg.value())
+            if data_dict is not None:
+                yield data_dict
+        
+        # Time between yields is spent in the caller, so this covers processing too
+        if self.fetch_sizer is not None and msgs:
+            process_end = time.monotonic()
+            settings = self.fetch_sizer.record(process_start - fetch_start, process_end - process_start,
+                                               len(msgs) == max_messages)
+            if settings:
+                self._rebuild_consumer(settings)
     
-    def poll(self, timeout: float = 1.0) -> Optional[Dict]:
+    def poll(self, timeout: float = 1.0) -> Optional[Union[ParsedBlock, Dict]]:
         """
         Poll for a new message from Kafka.
         
+        Single-message polls bypass adaptive fetch sizing: their timings say
+        nothing about batch throughput, so the batch is closed as soon as its
+        message is taken.
+        
         Args:
             timeout: Poll timeout in seconds
             
         Returns:
-            Parsed message dictionary or None if no message
+            Parsed block or None if no message
         """
-        msg = self.consumer.poll(timeout=timeout)
-        
-        if msg is None:
-            return None
-        
-        if msg.error():
-            if msg.error().code() == KafkaError._PARTITION_EOF:
-                return None
-            else:
-                raise KafkaException(msg.error())
-        
-        buffer = msg.value()
-        return self.parse_message(buffer)
+        batch = self.poll_batch(max_messages=1, timeout=timeout)
+        try:
+            return next(batch, None)
+        finally:
+            batch.close()
     
-    def stream(self, callback: Callable[[Dict], None]):
+    def stream(self, callback: Callable[[Union[ParsedBlock, Dict]], None], max_messages: int = 500):
         """
         Stream messages and call callback for each message.
         
         Args:
-            callback: Function to call with each parsed message
+            callback: Function to call with each parsed block
+            max_messages: Maximum number of messages to fetch per batch
         """
         try:
             while True:
-                data_dict = self.poll()
-                if data_dict is not None:
+                for data_dict in self.poll_batch(max_messages=max_messages):
                     callback(data_dict)
         except KeyboardInterrupt:
             print("Stopping stream...")
         finally:
             self.close()
     
+    def start_background(self, out_queue: queue.Queue, max_messages: int = 500, timeout: float = 1.0) -> threading.Thread:
+        """
+        Consume and parse messages on a daemon thread, pushing results into a queue.
+        
+        When the queue is full the oldest message is dropped, so consumers always
+        see the latest blocks.
+        
+        Args:
+            out_queue: Bounded queue that receives parsed blocks
+            max_messages: Maximum number of messages to fetch per batch
+            timeout: Consume timeout in seconds
+            
+        Returns:
+            The started background thread
+        """
+        def run():
+            while not self._stop_event.is_set():
+                try:
+                    for data_dict in self.poll_batch(max_messages=max_messages, timeout=timeout):
+                        self._put_latest(out_queue, data_dict)
+                except KafkaException as e:
+                    logger.error("ERROR: Kafka error in background consumer: %s", e)
+                except Exception as e:
+                    # Keep consuming; the rest of the failed batch is skipped
+                    logger.exception("ERROR: Error processing message batch: %s", e)
+        
+        self._thread = threading.Thread(target=run, name='bitquery-stream', daemon=True)
+        self._thread.start()
+        return self._thread
+    
+    @staticmethod
+    def _put_latest(out_queue: queue.Queue, item: Union[ParsedBlock, Dict]):
+        """Put item into the queue, dropping the oldest entries while it is full."""
+        while True:
+            try:
+                out_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    out_queue.get_nowait()
+                except queue.Empty:
+                    pass
+    
     def close(self):
-        """Close the Kafka consumer."""
-        self.consumer.close()
+        """Stop the background thread (if running) and close the Kafka consumer."""
+        with self._consumer_lock:
+            if self._closed:
+                return
+            self._closed = True
+        
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        with self._consumer_lock:
+            self.consumer.close()
 
@@ -3,11 +3,29 @@ Live Trading Script - Executes real trades on DEX based on stream data.
 WARNING: This executes REAL trades with REAL funds. Use with caution!
 """
 
+import logging
+import queue
 import time
-from typing import Dict, Optional, List
-from stream import BitqueryStream
+from collections import deque
+from typing import Deque, Dict, Optional, List
+import requests
+from web3.exceptions import Web3Exception
+from stream import BitqueryStream, ParsedBlock
 from trader import DEXTrader
-from utils.price_utils import get_median_slippage_bps, get_best_direction_by_liquidity
+from utils.price_utils import get_median_slippage_bps, get_best_direction_with_medians
+from utils.token_utils import get_token_balance, get_token_balances_multi
+from utils.logging_utils import setup_logging
+from utils.transaction_utils import AMOUNT_MEASURED
+
+logger = logging.getLogger(__name__)
+
+# Errors a block-number RPC read can raise (connection/HTTP failures, bad responses)
+RPC_ERRORS = (requests.RequestException, ValueError, Web3Exception)
+
+SEPARATOR = "-" * 32
+
+# Bound once at import: should_trade runs for every pool event
+_time = time.time
 
 
 class TradingStrategy:
@@ -41,34 +59,69 @@ class TradingStrategy:
         self.min_profit_threshold = min_profit_threshold
         self.trade_direction = trade_direction
         self.enabled = enabled
-        self.last_trade_time = 0
+        self.last_trade_time = 0.0
         self.min_trade_interval = 5.0  # Minimum seconds between trades
         self.total_trades = 0
         self.successful_trades = 0
         self.failed_trades = 0
         self.close_blocks = close_blocks
-        self.open_positions: List[Dict] = []  # Track positions that need to be closed
+        self.open_positions: Deque[Dict] = deque()  # Positions with status 'open', oldest first
+        self.failed_positions: List[Dict] = []  # Positions that failed to close (kept for debugging)
+        self.block_cache_ttl = 1.0  # Seconds to reuse the last observed block number
+        self._block_cache = (0, float('-inf'))  # (block number, monotonic time fetched)
+        self._last_check_block = -1  # Last block check_and_close_positions ran for
+        self.pending_trades: Dict[str, Dict] = {}  # Submitted trades awaiting receipts, by tx hash
         
-    def should_trade(self, pool_event: Dict) -> bool:
-        """Determine if we should trade on this pool event."""
+    def get_current_block(self) -> int:
+        """
+        Get the current block number, reusing the last RPC result for block_cache_ttl seconds.
+        
+        Blocks arrive every ~12s, so polling eth_blockNumber for every event is wasted RPC.
+        """
+        block_number, fetched_at = self._block_cache
+        now = time.monotonic()
+        if now - fetched_at < self.block_cache_ttl:
+            return block_number
+        
+        block_number = self.trader.w3.eth.block_number
+        self._block_cache = (block_number, now)
+        return block_number
+    
+    def ready_to_trade(self) -> bool:
+        """
+        Check the conditions for opening a trade that do not depend on the event.
+        
+        These are the same for every event in a block, so run_trading checks them
+        once per block and skips the block's events entirely when they fail.
+        """
         if not self.enabled:
             return False
         
         # Don't open new trades if there are open positions - wait for them to close
-        open_positions_count = len([p for p in self.open_positions if p.get('status') == 'open'])
-        if open_positions_count > 0:
+        if self.open_positions or self.pending_trades:
             return False
         
-        current_time = time.time()
-        if current_time - self.last_trade_time < self.min_trade_interval:
+        if _time() - self.last_trade_time < self.min_trade_interval:
             # Silently skip - too frequent trades
             return False
         
+        return True
+    
+    def should_trade(self, pool_event: Dict) -> bool:
+        """
+        Determine if we should trade on this pool event.
+        
+        Most events are rejected, so the cheap scalar checks run before any
+        lookups into the event itself.
+        """
+        if not self.ready_to_trade():
+            return False
+        
         if not pool_event.get('PoolPriceTable'):
             return False
         
-        liquidity = pool_event.get('Liquidity', {})
-        if not liquidity.get('AmountCurrencyA') or not liquidity.get('AmountCurrencyB'):
+        liquidity = pool_event.get('Liquidity')
+        if not liquidity or not liquidity.get('AmountCurrencyA') or not liquidity.get('AmountCurrencyB'):
             return False
         
         return True
@@ -85,25 +138,29 @@ class TradingStrategy:
         
         # Determine trade direction dynamically based on liquidity (default behavior)
         # Only use fixed direction if explicitly set to 'AtoB' or 'BtoA'
+        medians: Dict[str, Optional[int]] = {}
         if self.trade_direction is None:
-            direction = get_best_direction_by_liquidity(pool_event, verbose=True)
+            direction, medians = get_best_direction_with_medians(pool_event, verbose=True)
             if direction is None:
                 # Fallback to AtoB if cannot determine
                 direction = 'AtoB'
-                print(f"  WARNING: Could not determine direction from liquidity, defaulting to {direction}")
+                logger.warning("  WARNING: Could not determine direction from liquidity, defaulting to %s", direction)
             else:
-                print(f"  Final Direction: {direction}")
+                logger.info("  Final Direction: %s", direction)
         else:
             direction = self.trade_direction
-            print(f"  Using fixed direction: {direction}")
+            logger.info("  Using fixed direction: %s", direction)
         
         # Get median slippage from stream, fallback to default if not available
-        pool_price_table = pool_event.get('PoolPriceTable', {})
-        median_slippage = get_median_slippage_bps(pool_price_table, direction)
+        # (reusing the medians computed during direction selection when available)
+        if direction in medians:
+            median_slippage = medians[direction]
+        else:
+            median_slippage = get_median_slippage_bps(pool_event.get('PoolPriceTable', {}), direction)
         if median_slippage is None:
             median_slippage = self.slippage_bps  # Fallback to default
-        print(f"Median slippage chosen: {median_slippage} bps")
-        print(f"Direction chosen: {direction}")
+        logger.info("Median slippage chosen: %s bps", median_slippage)
+        logger.info("Direction chosen: %s", direction)
         try:
             result = self.trader.execute_trade(
                 pool_event=pool_event,
@@ -112,30 +169,57 @@ class TradingStrategy:
                 slippage_bps=median_slippage
             )
         except Exception as e:
-            print(f"  ERROR: Error executing trade: {str(e)}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("  ERROR: Error executing trade: %s", e)
             result = None
         
         self.total_trades += 1
         self.last_trade_time = time.time()
         
+        if result and result.get('status') == 'submitted':
+            # Confirmation arrives later through process_trade_results()
+            self.pending_trades[result['tx_hash']] = {
+                'kind': 'open',
+                'trade_number': self.total_trades,
+                'direction': direction,
+                'pool_event': pool_event,
+                'slippage_bps': median_slippage
+            }
+            logger.info("  Trade #%d submitted | TX: %s", self.total_trades, result['tx_hash'])
+        else:
+            self._handle_open_result(result, self.total_trades, direction, pool_event, median_slippage)
+        
+        return result
+    
+    def _handle_open_result(
+        self,
+        result: Optional[Dict],
+        trade_number: int,
+        direction: str,
+        pool_event: Dict,
+        median_slippage: int
+    ) -> None:
+        """Record the outcome of an opening trade, opening a position when it confirmed."""
         if result:
             if result.get('status') == 'confirmed':
                 self.successful_trades += 1
                 block_number = result.get('block_number')
                 
-                print(f"Trade #{self.total_trades}: {result.get('direction', direction)} | "
-                      f"In: {result.get('amount_in', self.trade_amount):.6f} {result.get('currency_a', '')} | "
-                      f"Out: {result.get('amount_out', 0):.6f} {result.get('currency_b', '')} | "
-                      f"Price: {result.get('price', 0):.6f} |"
-                      f"Slippage: {result.get('slippage_bps', self.slippage_bps)} bps |"
-                      f"Pool ID: {result.get('pool_id', '')} |"
-                      f"Currency A: {result.get('currency_a', '')} |"
-                      f"Currency B: {result.get('currency_b', '')} |"
-                      f"Protocol: {result.get('protocol', '')} |"
-                      f"Block: {block_number} |"
-                      f"TX: {result.get('tx_hash', 'N/A')}")
+                # Guarded so the summary's lookups are skipped entirely when INFO is off
+                if logger.isEnabledFor(logging.INFO):
+                    logger.info("Trade #%d: %s | In: %.6f %s | Out: %.6f %s | Price: %.6f |"
+                                "Slippage: %s bps |Pool ID: %s |Currency A: %s |Currency B: %s |"
+                                "Protocol: %s |Block: %s |TX: %s",
+                                trade_number, result.get('direction', direction),
+                                result.get('amount_in', self.trade_amount), result.get('currency_a', ''),
+                                result.get('amount_out', 0), result.get('currency_b', ''),
+                                result.get('price', 0),
+                                result.get('slippage_bps', self.slippage_bps),
+                                result.get('pool_id', ''),
+                                result.get('currency_a', ''),
+                                result.get('currency_b', ''),
+                                result.get('protocol', ''),
+                                block_number,
+                                result.get('tx_hash', 'N/A'))
                 
                 # Store position for closing in opposite direction
                 if block_number:
@@ -150,11 +234,16 @@ class TradingStrategy:
                     if amount_out is None or amount_out <= 0.000001:
                         if price > 0:
                             amount_out = amount_in * price
-                            print(f"  WARNING: amount_out was invalid ({result.get('amount_out', 0):.6f}), calculated from price: {amount_out:.6f}")
+                            logger.warning("  WARNING: amount_out was invalid (%.6f), calculated from price: %.6f",
+                                           result.get('amount_out', 0), amount_out)
                         else:
                             # Last resort: use trade_amount as fallback
                             amount_out = self.trade_amount
-                            print(f"  WARNING: Could not determine amount_out, using trade_amount: {amount_out:.6f}")
+                            logger.warning("  WARNING: Could not determine amount_out, using trade_amount: %.6f", amount_out)
+                    elif result.get('amount_out_source', AMOUNT_MEASURED) != AMOUNT_MEASURED:
+                        # Not measured; the close caps it at the wallet balance read then
+                        logger.warning("  WARNING: amount_out %.6f is the expected amount (%s), not a measured one",
+                                       amount_out, result.get('amount_out_source'))
                     
                     position = {
                         'open_block': block_number,
@@ -162,6 +251,7 @@ class TradingStrategy:
                         'opposite_direction': opposite_direction,
                         'pool_event': pool_event,
                         'amount_out': amount_out,  # Use validated output amount for closing
+                        'amount_out_source': result.get('amount_out_source', AMOUNT_MEASURED),
                         'pool_id': result.get('pool_id', ''),
                         'currency_a': result.get('currency_a', ''),
                         'currency_b': result.get('currency_b', ''),
@@ -169,55 +259,67 @@ class TradingStrategy:
                         'status': 'open'
                     }
                     self.open_positions.append(position)
-                    print(f"  Position opened at block {block_number}, will close in {self.close_blocks} blocks (direction: {opposite_direction})")
+                    logger.info("  Position opened at block %s, will close in %d blocks (direction: %s)",
+                                block_number, self.close_blocks, opposite_direction)
             elif result.get('status') == 'failed':
                 self.failed_trades += 1
         else:
             self.failed_trades += 1
             # Only print if we actually attempted a trade (to avoid spam)
-            if self.total_trades > 0:
-                print(f"  WARNING: Trade #{self.total_trades} failed (execute_trade returned None)")
-        
-        return result
+            if trade_number > 0:
+                logger.warning("  WARNING: Trade #%d failed (execute_trade returned None)", trade_number)
     
     def check_and_close_positions(self, current_block: int) -> None:
         """Check for positions that need to be closed and execute opposite trades."""
         if not self.enabled:
             return
         
-        positions_to_close = []
-        for position in self.open_positions:
-            if position.get('status') != 'open':
-                continue
-            
-            open_block = position.get('open_block', 0)
-            blocks_elapsed = current_block - open_block
+        # Close conditions only depend on the block number, so check once per new block
+        if current_block == self._last_check_block:
+            return
+        self._last_check_block = current_block
+        
+        # Positions are opened in block order, so only the front of the queue can be due
+        positions_to_close: List[Dict] = []
+        while self.open_positions:
+            blocks_elapsed = current_block - self.open_positions[0]['open_block']
             
             # Close position if we're within the close_blocks window (2 or 3 blocks)
-            if blocks_elapsed >= self.close_blocks:
-                positions_to_close.append(position)
+            if blocks_elapsed < self.close_blocks:
+                break
+            positions_to_close.append(self.open_positions.popleft())
+        if not positions_to_close:
+            return
         
+        # Determine which token each position swaps back (the one received from the opening trade)
+        tokens_to_swap: List[Dict] = []
         for position in positions_to_close:
+            pool = position['pool_event'].get('Pool', {})
+            if position['opposite_direction'] == 'BtoA':
+                tokens_to_swap.append(pool.get('CurrencyB', {}))
+            else:
+                tokens_to_swap.append(pool.get('CurrencyA', {}))
+        
+        # Fetch all balances in one multicall; a token whose balance was spent by an
+        # earlier close in this loop is refetched individually
+        balances = get_token_balances_multi(tokens_to_swap, self.trader.w3, self.trader.address)
+        spent_tokens = set()
+        log_info = logger.isEnabledFor(logging.INFO)
+        
+        for position, token_to_swap, prefetched_balance in zip(positions_to_close, tokens_to_swap, balances):
             try:
-                pool_event = position.get('pool_event')
-                opposite_direction = position.get('opposite_direction')
+                pool_event: Dict = position['pool_event']
+                opposite_direction: str = position['opposite_direction']
+                open_block = position['open_block']
                 stored_amount_out = position.get('amount_out', self.trade_amount)
                 slippage_bps = position.get('slippage_bps', self.slippage_bps)
                 
-                # Get actual token balance to ensure we don't try to swap more than we have
-                pool = pool_event.get('Pool', {})
-                currency_a = pool.get('CurrencyA', {})
-                currency_b = pool.get('CurrencyB', {})
-                
-                # Determine which token we need to swap (the one we received from opening trade)
-                if opposite_direction == 'BtoA':
-                    token_to_swap = currency_b  # We received currency_b, now swap it back
+                # Get actual balance to ensure we don't try to swap more than we have
+                token_key = token_to_swap.get('SmartContract')
+                if token_key in spent_tokens:
+                    actual_balance = get_token_balance(token_to_swap, self.trader.w3, self.trader.address)
                 else:
-                    token_to_swap = currency_a  # We received currency_a, now swap it back
-                
-                # Get actual balance
-                from utils.token_utils import get_token_balance
-                actual_balance = get_token_balance(token_to_swap, self.trader.w3, self.trader.address)
+                    actual_balance = prefetched_balance
                 
                 # Determine amount to use for closing
                 # If stored amount is 0 or very small (likely invalid/calculation failed), use actual balance
@@ -225,33 +327,44 @@ class TradingStrategy:
                 if stored_amount_out is None or stored_amount_out <= 0.000001:
                     # Stored amount is invalid, use actual balance
                     if actual_balance is None or actual_balance <= 0:
-                        print(f"\nClosing position opened at block {position.get('open_block')} (current: {current_block}, elapsed: {current_block - position.get('open_block')} blocks)")
-                        print(f"   WARNING: Cannot close position - no valid amount. Stored: {stored_amount_out:.6f}, Actual: {actual_balance if actual_balance is not None else 'N/A'}")
+                        if log_info:
+                            logger.info("\nClosing position opened at block %s (current: %s, elapsed: %s blocks)",
+                                        open_block, current_block, current_block - open_block)
+                        logger.warning("   WARNING: Cannot close position - no valid amount. Stored: %.6f, Actual: %s",
+                                       stored_amount_out, actual_balance if actual_balance is not None else 'N/A')
                         position['status'] = 'close_failed'
-                        print("--------------------------------")
+                        if log_info:
+                            logger.info(SEPARATOR)
                         continue
                     amount_out = actual_balance
                 elif actual_balance is None:
                     # Can't get actual balance, use stored amount (but warn)
                     amount_out = stored_amount_out
-                    print(f"   WARNING: Could not get actual balance, using stored amount")
+                    logger.warning("   WARNING: Could not get actual balance, using stored amount")
                 else:
                     # Both are valid, use minimum for safety
                     amount_out = min(stored_amount_out, actual_balance)
                 
                 # Final safety check - don't try to swap 0 or negative amounts
                 if amount_out <= 0:
-                    print(f"\nClosing position opened at block {position.get('open_block')} (current: {current_block}, elapsed: {current_block - position.get('open_block')} blocks)")
-                    print(f"   WARNING: Cannot close position - amount is 0 or negative: {amount_out:.6f}")
+                    if log_info:
+                        logger.info("\nClosing position opened at block %s (current: %s, elapsed: %s blocks)",
+                                    open_block, current_block, current_block - open_block)
+                    logger.warning("   WARNING: Cannot close position - amount is 0 or negative: %.6f", amount_out)
                     position['status'] = 'close_failed'
-                    print("--------------------------------")
+                    if log_info:
+                        logger.info(SEPARATOR)
                     continue
                 
-                print(f"\nClosing position opened at block {position.get('open_block')} (current: {current_block}, elapsed: {current_block - position.get('open_block')} blocks)")
-                actual_balance_str = f"{actual_balance:.6f}" if actual_balance is not None else "N/A"
-                print(f"   Direction: {opposite_direction} | Stored amount: {stored_amount_out:.6f} | Actual balance: {actual_balance_str} | Using: {amount_out:.6f}")
+                if log_info:
+                    logger.info("\nClosing position opened at block %s (current: %s, elapsed: %s blocks)",
+                                open_block, current_block, current_block - open_block)
+                    logger.info("   Direction: %s | Stored amount: %.6f | Actual balance: %s | Using: %.6f",
+                                opposite_direction, stored_amount_out,
+                                f"{actual_balance:.6f}" if actual_balance is not None else "N/A", amount_out)
                 
                 # Execute opposite trade
+                spent_tokens.add(token_key)
                 result = self.trader.execute_trade(
                     pool_event=pool_event,
                     direction=opposite_direction,
@@ -259,49 +372,99 @@ class TradingStrategy:
                     slippage_bps=slippage_bps
                 )
                 
-                if result:
-                    if result.get('status') == 'confirmed':
-                        position['status'] = 'closed'
-                        position['close_tx'] = result.get('tx_hash')
-                        position['close_block'] = result.get('block_number')
-                        print(f"Position closed successfully | TX: {result.get('tx_hash', 'N/A')} | Block: {result.get('block_number', 'N/A')}")
-                        print("--------------------------------")
-                    elif result.get('status') == 'failed':
-                        position['status'] = 'close_failed'
-                        print(f"Failed to close position | TX: {result.get('tx_hash', 'N/A')}")
-                        print("--------------------------------")
+                if result and result.get('status') == 'submitted':
+                    # Confirmation arrives later through process_trade_results()
+                    position['status'] = 'closing'
+                    self.pending_trades[result['tx_hash']] = {'kind': 'close', 'position': position}
+                    logger.info("  Close submitted | TX: %s", result['tx_hash'])
                 else:
-                    position['status'] = 'close_failed'
-                    print(f"Failed to close position (no result)")
-                    print("--------------------------------")
+                    self._handle_close_result(position, result, log_info)
             except Exception as e:
-                print(f"ERROR: Error closing position: {str(e)}")
+                logger.exception("ERROR: Error closing position: %s", e)
                 position['status'] = 'close_error'
-                print("--------------------------------")
-        # Remove closed positions from tracking (keep failed ones for debugging)
-        self.open_positions = [p for p in self.open_positions if p.get('status') in ['open', 'close_failed', 'close_error']]
+                if log_info:
+                    logger.info(SEPARATOR)
+        # Drop closed positions, keep failed ones for debugging and requeue any still open
+        still_open = []
+        for position in positions_to_close:
+            status = position.get('status')
+            if status == 'open':
+                still_open.append(position)
+            elif status in ('close_failed', 'close_error'):
+                self.failed_positions.append(position)
+        self.open_positions.extendleft(reversed(still_open))
+    
+    def _handle_close_result(self, position: Dict, result: Optional[Dict], log_info: bool) -> None:
+        """Record the outcome of a closing trade on its position."""
+        if result:
+            if result.get('status') == 'confirmed':
+                position['status'] = 'closed'
+                position['close_tx'] = result.get('tx_hash')
+                position['close_block'] = result.get('block_number')
+                logger.info("Position closed successfully | TX: %s | Block: %s",
+                            result.get('tx_hash', 'N/A'), result.get('block_number', 'N/A'))
+                if log_info:
+                    logger.info(SEPARATOR)
+            elif result.get('status') == 'failed':
+                position['status'] = 'close_failed'
+                logger.info("Failed to close position | TX: %s", result.get('tx_hash', 'N/A'))
+                if log_info:
+                    logger.info(SEPARATOR)
+        else:
+            position['status'] = 'close_failed'
+            logger.info("Failed to close position (no result)")
+            if log_info:
+                logger.info(SEPARATOR)
+    
+    def process_trade_results(self) -> None:
+        """Apply the results of submitted trades whose receipts have come back."""
+        results = self.trader.poll_results()
+        if not results:
+            return
+        log_info = logger.isEnabledFor(logging.INFO)
+        for result in results:
+            pending = self.pending_trades.pop(result.get('tx_hash', ''), None)
+            if pending is None:
+                continue
+            
+            if pending['kind'] == 'open':
+                self._handle_open_result(result, pending['trade_number'], pending['direction'],
+                                         pending['pool_event'], pending['slippage_bps'])
+                continue
+            
+            position = pending['position']
+            self._handle_close_result(position, result, log_info)
+            status = position.get('status')
+            if status == 'closing':
+                # Receipt not found in time; retry the close on a later block
+                position['status'] = 'open'
+                self.open_positions.appendleft(position)
+            elif status in ('close_failed', 'close_error'):
+                self.failed_positions.append(position)
     
     def get_statistics(self) -> Dict:
         """Get trading statistics."""
-        open_positions_count = len([p for p in self.open_positions if p.get('status') == 'open'])
+        open_positions_count = len(self.open_positions)
         return {
             'total_trades': self.total_trades,
             'successful_trades': self.successful_trades,
             'failed_trades': self.failed_trades,
             'success_rate': (self.successful_trades / self.total_trades * 100) if self.total_trades > 0 else 0,
-            'open_positions': open_positions_count
+            'open_positions': open_positions_count,
+            'pending_trades': len(self.pending_trades)
         }
     
     def print_statistics(self):
         """Print current trading statistics."""
         stats = self.get_statistics()
-        print(f"\n=== Trading Statistics ===")
-        print(f"Total Trades: {stats['total_trades']}")
-        print(f"Successful: {stats['successful_trades']}")
-        print(f"Failed: {stats['failed_trades']}")
-        print(f"Success Rate: {stats['success_rate']:.2f}%")
-        print(f"Open Positions: {stats['open_positions']}")
-        print("=" * 40)
+        logger.info("\n=== Trading Statistics ===")
+        logger.info("Total Trades: %d", stats['total_trades'])
+        logger.info("Successful: %d", stats['successful_trades'])
+        logger.info("Failed: %d", stats['failed_trades'])
+        logger.info("Success Rate: %.2f%%", stats['success_rate'])
+        logger.info("Open Positions: %d", stats['open_positions'])
+        logger.info("Pending Trades: %d", stats['pending_trades'])
+        logger.info("=" * 40)
 
 
 def run_trading(
@@ -329,15 +492,21 @@ def run_trading(
         stats_interval: Print statistics every N events
         close_blocks: Number of blocks to wait before closing position (2 or 3)
     """
+    # Log records are formatted and written on a listener thread, off the trading loop.
+    # Started first so warnings raised while the trader and stream are set up go through it too.
+    log_listener = setup_logging()
+    
     # Initialize trader (reads from .env file automatically)
     try:
         trader = DEXTrader(slippage_bps=slippage_bps)
     except ValueError as e:
         print(f"ERROR: {str(e)}")
         print("   Please ensure your .env file has PRIVATE_KEY set")
+        log_listener.stop()
         return
     except Exception as e:
         print(f"ERROR: Error initializing trader: {str(e)}")
+        log_listener.stop()
         return
     
     # Initialize strategy
@@ -351,93 +520,121 @@ def run_trading(
         close_blocks=close_blocks
     )
     
-    # Initialize stream
+    # Initialize stream; Kafka polling and protobuf parsing run on a background thread
     stream = BitqueryStream(topic=topic)
+    events: queue.Queue = queue.Queue(maxsize=1024)
     
-    print(f"Starting live trading...")
-    print(f"Trade Amount: {trade_amount}")
-    print(f"Slippage: {slippage_bps} bps")
-    print(f"Trade Direction: {trade_direction}")
-    print(f"Close Position After: {close_blocks} blocks")
-    print(f"\nNote: Consumer is set to 'latest' offset - waiting for NEW messages only")
-    print(f"Press Ctrl+C to stop\n")
-    print("Waiting for messages from Kafka stream...")
+    logger.info("Starting live trading...")
+    logger.info("Trade Amount: %s", trade_amount)
+    logger.info("Slippage: %s bps", slippage_bps)
+    logger.info("Trade Direction: %s", trade_direction)
+    logger.info("Close Position After: %s blocks", close_blocks)
+    logger.info("\nNote: Consumer is set to 'latest' offset - waiting for NEW messages only")
+    logger.info("Press Ctrl+C to stop\n")
+    logger.info("Waiting for messages from Kafka stream...")
     
     event_count = 0
     
-    def process_event(pool_event: Dict):
+    def process_event(pool_event: ParsedBlock):
         nonlocal event_count
         event_count += 1
         
         # Get current block number to check for positions that need closing
         try:
-            current_block = trader.w3.eth.block_number
-            # Check and close positions that are ready
-            strategy.check_and_close_positions(current_block)
-        except Exception:
+            current_block = strategy.get_current_block()
+        except RPC_ERRORS:
             # If we can't get block number, skip position closing for this event
             pass
+        else:
+            # Check and close positions that are ready
+            strategy.check_and_close_positions(current_block)
         
-        try:
-            pool_events = pool_event.get('PoolEvents', [])
-            if not pool_events:
-                return
+        pool_events = pool_event.get('PoolEvents', [])
+        if not pool_events:
+            return
+        
+        # No event in this block can open a trade; skip walking them
+        if not strategy.ready_to_trade():
+            if event_count % stats_interval == 0:
+                strategy.print_statistics()
+            return
+        
+        # Extract Header (with BaseFee) from block-level data for gas price fallback
+        block_header = pool_event.get('Header', {})
+        
+        for event in pool_events:
+            if not isinstance(event, dict):
+                continue
             
-            # Extract Header (with BaseFee) from block-level data for gas price fallback
-            block_header = pool_event.get('Header', {})
+            if 'PoolPriceTable' not in event or 'Pool' not in event:
+                continue
             
-            for event in pool_events:
-                if not isinstance(event, dict):
-                    continue
-                
-                if 'PoolPriceTable' not in event or 'Pool' not in event:
-                    continue
-                
-                # Add Header to event for gas extraction (if not already present)
-                if block_header and 'Header' not in event:
-                    event['Header'] = block_header
-                
-                try:
-                    result = strategy.execute_strategy(event)
-                    
-                    if max_trades and strategy.total_trades >= max_trades:
-                        print(f"\nReached maximum trades limit: {max_trades}")
-                        stream.close()
-                        return
-                except Exception as e:
-                    continue
+            # Add Header to event for gas extraction (if not already present)
+            if block_header and 'Header' not in event:
+                event['Header'] = block_header
             
-        except Exception as e:
-            return
+            try:
+                strategy.execute_strategy(event)
+            except (KeyError, TypeError, ValueError) as e:
+                # Malformed event data; skip this event
+                logger.warning("  WARNING: Skipping malformed pool event: %s", e)
+                continue
+            
+            if max_trades and strategy.total_trades >= max_trades:
+                logger.info("\nReached maximum trades limit: %s", max_trades)
+                stream.close()
+                return
+            
+            # A trade was just placed; the rest of the block cannot open another
+            if not strategy.ready_to_trade():
+                break
         
         if event_count % stats_interval == 0:
             strategy.print_statistics()
     
     try:
+        stream.start_background(events, max_messages=500, timeout=1.0)
+        
         while True:
-            data_dict = stream.poll(timeout=1.0)
+            try:
+                data_dict = events.get(timeout=1.0)
+            except queue.Empty:
+                data_dict = None
             
-            # Always check for positions that need closing, even if no new event
+            # One bad receipt or message must not stop the trader while positions are open
             try:
-                current_block = trader.w3.eth.block_number
-                strategy.check_and_close_positions(current_block)
+                # Apply receipts that came back since the last iteration
+                strategy.process_trade_results()
+                
+                # Always check for positions that need closing, even if no new event
+                try:
+                    current_block = strategy.get_current_block()
+                except RPC_ERRORS:
+                    # If we can't get block number, skip position closing
+                    pass
+                else:
+                    strategy.check_and_close_positions(current_block)
+                
+                if data_dict is not None:
+                    process_event(data_dict)
             except Exception:
-                # If we can't get block number, skip position closing
-                pass
+                logger.exception("  ERROR: Unexpected error in trading loop, continuing")
             
             if data_dict is not None:
-                process_event(data_dict)
+                stream.recycle(data_dict)
                 
                 if max_trades and strategy.total_trades >= max_trades:
-                    print(f"\nReached maximum trades limit: {max_trades}")
+                    logger.info("\nReached maximum trades limit: %s", max_trades)
                     break
             
     except KeyboardInterrupt:
-        print("\nTrading stopped by user")
+        logger.info("\nTrading stopped by user")
     finally:
         stream.close()
+        trader.close()
         strategy.print_statistics()
-        print("\nTrading complete!")
+        logger.info("\nTrading complete!")
+        log_listener.stop()
 
 
 if __name__ == '__main__':
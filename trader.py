@@ -2,24 +2,95 @@
 DEX Trader - Executes real trades on Uniswap and other DEX protocols.
 """
 
+import logging
 import os
-from typing import Dict, Optional
-from decimal import Decimal
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from web3 import Web3
 from dotenv import load_dotenv
 
 from utils.token_utils import get_token_address, WETH_ADDRESS
 from utils.price_utils import get_price_for_slippage
 from utils.gas_utils import GasManager, extract_gas_from_stream
+from utils.balance_utils import AllowanceCache, PreTradeState
+from utils.nonce_utils import NonceManager
 from utils.conversion_utils import convert_amount_to_smallest_unit, calculate_amount_out_min
-from utils.transaction_utils import calculate_actual_amount_out
+from utils.transaction_utils import calculate_actual_amount_out_batch
 from uniswap.uniswap_v2 import UniswapV2Swapper
 from uniswap.uniswap_v3 import UniswapV3Swapper
-from eth_utils import to_checksum_address
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Seconds before an RPC request is abandoned
+RPC_TIMEOUT = 5
+
+# Seconds to wait for a submitted transaction to be mined
+RECEIPT_TIMEOUT = 120
+
+# Seconds between checks for a new block while transactions are pending
+BLOCK_POLL_INTERVAL = 1.0
+
+# Pools whose static metadata is kept (the cache is cleared when full)
+POOL_CACHE_SIZE = 1024
+
+
+class PoolMeta:
+    """Static per-pool data needed to trade a pool, extracted once per pool ID."""
+    
+    __slots__ = ('token_a', 'token_b', 'decimals_a', 'decimals_b', 'symbol_a', 'symbol_b', 'protocol', 'protocol_name')
+    
+    def __init__(self, pool: Dict, pool_event: Dict):
+        """
+        Extract pool metadata.
+        
+        Args:
+            pool: Pool dictionary with CurrencyA and CurrencyB
+            pool_event: Pool event dictionary (for the Dex protocol)
+        """
+        currency_a = pool['CurrencyA']
+        currency_b = pool['CurrencyB']
+        self.token_a = get_token_address(currency_a)
+        self.token_b = get_token_address(currency_b)
+        try:
+            self.decimals_a = int(currency_a.get('Decimals', 18))
+            self.decimals_b = int(currency_b.get('Decimals', 18))
+        except:
+            self.decimals_a = 18
+            self.decimals_b = 18
+        self.symbol_a = currency_a.get('Symbol', '')
+        self.symbol_b = currency_b.get('Symbol', '')
+        self.protocol_name = pool_event.get('Dex', {}).get('ProtocolName', '')
+        self.protocol = self.protocol_name.lower()
+
+
+def _make_rpc_session() -> requests.Session:
+    """
+    Create a keep-alive HTTP session for the RPC provider.
+    
+    Every RPC on the trade path reuses pooled connections instead of paying a
+    TCP/TLS handshake. Connection failures are retried quickly; other errors are not.
+    
+    Returns:
+        Configured requests session
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.05)
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
 
 class DEXTrader:
     """Executes real trades on DEX protocols."""
@@ -58,7 +129,11 @@ class DEXTrader:
         
         # Setup Web3
         if rpc_url:
-            self.w3 = Web3(Web3.HTTPProvider(rpc_url))
+            self.w3 = Web3(Web3.HTTPProvider(
+                rpc_url,
+                request_kwargs={'timeout': RPC_TIMEOUT},
+                session=_make_rpc_session()
+            ))
         
         if not self.w3.is_connected():
             raise ConnectionError("Failed to connect to Ethereum node")
@@ -76,21 +151,38 @@ class DEXTrader:
             max_gas_price_gwei=max_gas_price_gwei
         )
         
+        # Track the wallet nonce and allowances locally; shared by both swappers
+        self.nonce_manager = NonceManager(self.w3, self.address)
+        self.allowance_cache = AllowanceCache()
+        
         # Setup Uniswap swappers
         self.uniswap_v2 = UniswapV2Swapper(
             w3=self.w3,
             account=self.account,
             address=self.address,
-            gas_manager=self.gas_manager
+            gas_manager=self.gas_manager,
+            nonce_manager=self.nonce_manager,
+            allowance_cache=self.allowance_cache
         )
         self.uniswap_v3 = UniswapV3Swapper(
             w3=self.w3,
             account=self.account,
             address=self.address,
-            gas_manager=self.gas_manager
+            gas_manager=self.gas_manager,
+            nonce_manager=self.nonce_manager,
+            allowance_cache=self.allowance_cache
         )
         
         self.default_slippage_bps = slippage_bps
+        self._pool_cache: Dict[str, PoolMeta] = {}
+        
+        # Receipts are awaited off the trading loop; outcomes are collected with poll_results()
+        self._pending_receipts: Dict[bytes, tuple] = {}  # tx hash bytes -> (tx_hash, deadline, first block, watch args)
+        self._pending_lock = threading.Lock()
+        self._trade_results: queue.Queue = queue.Queue()
+        self._closed = threading.Event()
+        self._receipt_thread = threading.Thread(target=self._receipt_loop, name='receipt-watcher', daemon=True)
+        self._receipt_thread.start()
         
         # Check balance
         balance_wei = self.w3.eth.get_balance(self.address)
@@ -109,7 +201,8 @@ class DEXTrader:
         amount_in: int,
         amount_out_min: int,
         deadline: int = None,
-        stream_gas_price_wei: Optional[int] = None
+        stream_gas_price_wei: Optional[int] = None,
+        pre_trade_state: Optional[PreTradeState] = None
     ) -> Optional[str]:
         """
         Execute swap on Uniswap V2.
@@ -121,6 +214,7 @@ class DEXTrader:
             amount_out_min: Minimum amount out (in token's smallest unit)
             deadline: Transaction deadline timestamp (None for 20 minutes from now)
             stream_gas_price_wei: Gas price from stream in Wei (optional)
+            pre_trade_state: Pre-fetched wallet state (None lets the swapper fetch it)
             
         Returns:
             Transaction hash or None if failed
@@ -131,7 +225,8 @@ class DEXTrader:
             amount_in=amount_in,
             amount_out_min=amount_out_min,
             deadline=deadline,
-            stream_gas_price_wei=stream_gas_price_wei
+            stream_gas_price_wei=stream_gas_price_wei,
+            pre_trade_state=pre_trade_state
         )
     
     def execute_swap_uniswap_v3(
@@ -142,7 +237,8 @@ class DEXTrader:
         amount_out_min: int,
         fee: int = 3000,
         deadline: int = None,
-        stream_gas_price_wei: Optional[int] = None
+        stream_gas_price_wei: Optional[int] = None,
+        pre_trade_state: Optional[PreTradeState] = None
     ) -> Optional[str]:
         """
         Execute swap on Uniswap V3.
@@ -155,6 +251,7 @@ class DEXTrader:
             fee: Pool fee in basis points (3000 = 0.3%)
             deadline: Transaction deadline timestamp
             stream_gas_price_wei: Gas price from stream in Wei (optional)
+            pre_trade_state: Pre-fetched wallet state (None lets the swapper fetch it)
             
         Returns:
             Transaction hash or None if failed
@@ -166,7 +263,8 @@ class DEXTrader:
             amount_out_min=amount_out_min,
             fee=fee,
             deadline=deadline,
-            stream_gas_price_wei=stream_gas_price_wei
+            stream_gas_price_wei=stream_gas_price_wei,
+            pre_trade_state=pre_trade_state
         )
     
     def execute_trade(
@@ -186,7 +284,8 @@ class DEXTrader:
             slippage_bps: Slippage tolerance in basis points
             
         Returns:
-            Trade result dictionary with tx_hash or None if failed
+            Trade result dictionary with tx_hash and status 'submitted', or None if failed.
+            The confirmed/failed/pending result for the tx_hash is later returned by poll_results().
         """
         if slippage_bps is None:
             slippage_bps = self.default_slippage_bps
@@ -197,40 +296,41 @@ class DEXTrader:
             print(f"  WARNING: Missing pool data, skipping trade")
             return None
         
-        currency_a = pool.get('CurrencyA', {})
-        currency_b = pool.get('CurrencyB', {})
-        if not currency_a or not currency_b:
-            print(f"  WARNING: Missing currency data (A: {bool(currency_a)}, B: {bool(currency_b)}), skipping trade")
-            return None
+        # Tokens, decimals and protocol are static per pool, so they are extracted once
+        pool_id = pool.get('PoolId', '')
+        meta = self._pool_cache.get(pool_id) if pool_id else None
+        if meta is None:
+            currency_a = pool.get('CurrencyA', {})
+            currency_b = pool.get('CurrencyB', {})
+            if not currency_a or not currency_b:
+                print(f"  WARNING: Missing currency data (A: {bool(currency_a)}, B: {bool(currency_b)}), skipping trade")
+                return None
+            meta = PoolMeta(pool, pool_event)
+            if pool_id:
+                if len(self._pool_cache) >= POOL_CACHE_SIZE:
+                    self._pool_cache.clear()
+                self._pool_cache[pool_id] = meta
         
-        # Get token addresses
+        # Get token addresses and decimals
         if direction == 'AtoB':
-            token_in_info = currency_a
-            token_out_info = currency_b
+            token_in_address, token_out_address = meta.token_a, meta.token_b
+            decimals_in, decimals_out = meta.decimals_a, meta.decimals_b
+            symbol_in, symbol_out = meta.symbol_a, meta.symbol_b
         else:
-            token_in_info = currency_b
-            token_out_info = currency_a
-        token_in_address = get_token_address(token_in_info)
-        token_out_address = get_token_address(token_out_info)
+            token_in_address, token_out_address = meta.token_b, meta.token_a
+            decimals_in, decimals_out = meta.decimals_b, meta.decimals_a
+            symbol_in, symbol_out = meta.symbol_b, meta.symbol_a
         
         # Print token addresses for debugging
         print(f"  Token In Address: {token_in_address}")
         print(f"  Token Out Address: {token_out_address}")
-        print(f"  Token In Symbol: {token_in_info.get('Symbol', 'N/A')}")
-        print(f"  Token Out Symbol: {token_out_info.get('Symbol', 'N/A')}")
+        print(f"  Token In Symbol: {symbol_in or 'N/A'}")
+        print(f"  Token Out Symbol: {symbol_out or 'N/A'}")
         
         if not token_in_address or not token_out_address:
             print(f"  WARNING: Missing token address, skipping trade")
             return None
         
-        # Get decimals
-        try:
-            decimals_in = int(token_in_info.get('Decimals', 18))
-            decimals_out = int(token_out_info.get('Decimals', 18))
-        except:
-            decimals_in = 18
-            decimals_out = 18
-        
         # Convert amount to smallest unit
         amount_in_smallest = convert_amount_to_smallest_unit(amount_in, decimals_in)
         
@@ -242,9 +342,11 @@ class DEXTrader:
             print(f"  WARNING: No price data available for slippage {slippage_bps} bps")
             return None
         
-        # Calculate expected output
-        price = Decimal(str(price_entry.get('Price', 0)))
-        expected_out = Decimal(str(amount_in)) * price
+        # Calculate expected output. The price arrives as a double and expected_out
+        # is only reported, so plain floats suffice; calculate_amount_out_min does
+        # the exact scaling for the on-chain minimum.
+        price = float(price_entry.get('Price', 0))
+        expected_out = amount_in * price
         
         # Calculate minimum amount out with slippage
         amount_out_min_smallest = calculate_amount_out_min(amount_in, price, decimals_out, slippage_bps)
@@ -253,7 +355,7 @@ class DEXTrader:
         stream_gas_price_wei = extract_gas_from_stream(pool_event)
         
         # Determine protocol and execute
-        protocol = pool_event.get('Dex', {}).get('ProtocolName', '').lower()
+        protocol = meta.protocol
         
         # Get pool fee for V3 (default 0.3%)
         fee = 3000  # Could extract from pool info if available
@@ -282,41 +384,169 @@ class DEXTrader:
             return None
         
         if tx_hash:
-            # Wait for confirmation (optional)
+            trade_info = {
+                'direction': direction,
+                'amount_in': float(amount_in),
+                'price': price,
+                'currency_a': symbol_in,
+                'currency_b': symbol_out,
+                'pool_id': pool_id,
+                'protocol': meta.protocol_name,
+                'slippage_bps': slippage_bps
+            }
+            # The swap was built after the event's block was seen, so it cannot be mined earlier
+            first_block = pool_event.get('Header', {}).get('Number')
+            if not isinstance(first_block, int):
+                first_block = None
+            # Confirmation is awaited in the background; the outcome arrives via poll_results()
+            with self._pending_lock:
+                self._pending_receipts[bytes.fromhex(tx_hash.removeprefix('0x'))] = (
+                    tx_hash,
+                    time.monotonic() + RECEIPT_TIMEOUT,
+                    first_block,
+                    (trade_info, token_out_address, decimals_out, expected_out)
+                )
+            return dict(trade_info, tx_hash=tx_hash, status='submitted')
+        
+        return None
+    
+    def _receipt_loop(self):
+        """
+        Resolve pending transactions as new blocks arrive.
+        
+        Runs on the receipt watcher thread. Instead of polling a receipt per
+        pending transaction, each new block's transaction hashes are read once and
+        a receipt is only fetched for our transactions that appear in it. If that
+        fetch fails (e.g. the node serving receipts is a block behind), the
+        receipt is fetched again on every pass until RECEIPT_TIMEOUT.
+        
+        Blocks are scanned from the earliest block a newly pending transaction
+        can be in (the block of the event it traded on), so a failed pass or
+        several blocks per poll interval cannot skip it.
+        """
+        # Last block whose transactions were checked
+        last_block = None
+        # Pending transactions all blocks up to last_block were checked for
+        watched: set = set()
+        # Transactions seen in a block whose receipt could not be fetched yet
+        retry: Dict[bytes, tuple] = {}
+        while not self._closed.wait(BLOCK_POLL_INTERVAL):
+            with self._pending_lock:
+                pending = dict(self._pending_receipts)
+            if not pending:
+                last_block = None
+                watched.clear()
+                retry.clear()
+                continue
+            pending_keys = set(pending)
+            
+            mined = [(key, pending.pop(key)) for key in retry if key in pending]
+            retry.clear()
+            if mined:
+                retry.update(self._resolve_receipts(mined, last_block))
+            
             try:
-                receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
-                if receipt.status == 1:
-                    # Get actual amount received by checking token balance
-                    actual_amount_out = calculate_actual_amount_out(
-                        receipt,
-                        token_out_address,
-                        decimals_out,
-                        self.w3,
-                        self.address,
-                        float(expected_out)
-                    )
-                    
-                    return {
-                        'tx_hash': tx_hash,
-                        'status': 'confirmed',
-                        'block_number': receipt.blockNumber,
-                        'gas_used': receipt.gasUsed,
-                        'direction': direction,
-                        'amount_in': float(amount_in),
-                        'amount_out': actual_amount_out,  # Use actual amount received
-                        'price': float(price),
-                        'currency_a': token_in_info.get('Symbol', ''),
-                        'currency_b': token_out_info.get('Symbol', ''),
-                        'pool_id': pool.get('PoolId', ''),
-                        'protocol': pool_event.get('Dex', {}).get('ProtocolName', ''),
-                        'slippage_bps': slippage_bps
-                    }
-                else:
-                    print(f"  WARNING: Transaction failed (status: {receipt.status})")
-                    return {'tx_hash': tx_hash, 'status': 'failed'}
+                current_block = self.w3.eth.block_number
+                first_block = current_block if last_block is None else last_block + 1
+                for key, (_, _, tx_first_block, _) in pending.items():
+                    if key not in watched:
+                        # Without the event's block, the transaction was sent during the current block at the earliest
+                        first_block = min(first_block, current_block - 1 if tx_first_block is None else tx_first_block)
+                for block_number in range(first_block, current_block + 1):
+                    block = self.w3.eth.get_block(block_number)
+                    mined = []
+                    for mined_hash in block['transactions']:
+                        entry = pending.pop(bytes(mined_hash), None)
+                        if entry is not None:
+                            mined.append((bytes(mined_hash), entry))
+                    if mined:
+                        retry.update(self._resolve_receipts(mined, current_block))
+                    last_block = block_number
+                watched = pending_keys
             except Exception as e:
-                print(f"  WARNING: Error waiting for transaction receipt: {str(e)}")
-                return {'tx_hash': tx_hash, 'status': 'pending'}
+                logger.warning("  WARNING: Error checking new blocks for receipts: %s", e)
+            
+            # Give up on transactions that were not mined, or whose receipt was not fetched, in time;
+            # the receipt is asked for once more in case the block scan missed it
+            now = time.monotonic()
+            expired = [(key, entry) for key, entry in list(pending.items()) + list(retry.items()) if now >= entry[1]]
+            for key, _ in expired:
+                retry.pop(key, None)
+            if expired:
+                for key, (tx_hash, _, _, _) in self._resolve_receipts(expired, last_block).items():
+                    logger.warning("  WARNING: Transaction %s not confirmed after %ss", tx_hash, RECEIPT_TIMEOUT)
+                    self._finish_receipt(key, {'tx_hash': tx_hash, 'status': 'pending'})
+    
+    def _resolve_receipts(self, mined: List[tuple], head_block: Optional[int]) -> Dict[bytes, tuple]:
+        """
+        Fetch the receipts of mined transactions (usually from one block) and queue their results.
         
-        return None
-
+        The amounts received by all successful swaps are calculated together, so
+        their balance reads go to the node as one batch.
+        
+        Args:
+            mined: List of (transaction hash bytes, pending entry) tuples, where each entry is
+                (tx_hash, deadline, first_block, (trade_info, token_out_address, decimals_out, expected_out))
+            head_block: Latest block number seen by the watcher (None if not known yet)
+        
+        Returns:
+            Pending entries by transaction hash bytes whose receipt could not be
+            fetched; they stay pending so the fetch can be retried
+        """
+        confirmed = []
+        unfetched: Dict[bytes, tuple] = {}
+        for key, entry in mined:
+            tx_hash, _, _, (trade_info, token_out_address, decimals_out, expected_out) = entry
+            try:
+                receipt = self.w3.eth.get_transaction_receipt(tx_hash)
+            except Exception as e:
+                logger.warning("  WARNING: Error fetching receipt of %s: %s", tx_hash, e)
+                unfetched[key] = entry
+                continue
+            if receipt.status == 1:
+                confirmed.append((key, tx_hash, trade_info, receipt, (receipt, token_out_address, decimals_out, expected_out)))
+            else:
+                logger.warning("  WARNING: Transaction failed (status: %s)", receipt.status)
+                self._finish_receipt(key, {'tx_hash': tx_hash, 'status': 'failed'})
+        if not confirmed:
+            return unfetched
+        
+        # Get actual amounts received from the logs or token balances
+        amounts_out = calculate_actual_amount_out_batch(
+            [item[4] for item in confirmed], self.w3, self.address, head_block
+        )
+        for (key, tx_hash, trade_info, receipt, _), (actual_amount_out, amount_out_source) in zip(confirmed, amounts_out):
+            self._finish_receipt(key, dict(
+                trade_info,
+                tx_hash=tx_hash,
+                status='confirmed',
+                block_number=receipt.blockNumber,
+                gas_used=receipt.gasUsed,
+                amount_out=actual_amount_out,  # Use actual amount received
+                amount_out_source=amount_out_source
+            ))
+        return unfetched
+    
+    def _finish_receipt(self, key: bytes, result: Dict):
+        """Stop watching a transaction and queue its result."""
+        with self._pending_lock:
+            self._pending_receipts.pop(key, None)
+        self._trade_results.put(result)
+    
+    def poll_results(self) -> List[Dict]:
+        """
+        Collect results of submitted trades whose receipts have been resolved.
+        
+        Returns:
+            List of result dictionaries (status 'confirmed', 'failed' or 'pending'), each with tx_hash
+        """
+        results = []
+        while True:
+            try:
+                results.append(self._trade_results.get_nowait())
+            except queue.Empty:
+                return results
+    
+    def close(self):
+        """Stop the receipt watcher without waiting for outstanding receipts."""
+        self._closed.set()
@@ -2,22 +2,90 @@
 Uniswap V2 swap execution logic.
 """
 
+import logging
 import time
-import traceback
+from functools import lru_cache
 from typing import Optional
 from web3 import Web3
-from eth_utils import to_checksum_address
+from eth_abi.registry import registry
+from eth_utils import keccak
+from utils.address_utils import address_bytes, checksum_address
 from utils.gas_utils import GasManager
-from utils.token_utils import WETH_ADDRESS, get_token_abi, check_and_approve_token
-from utils.balance_utils import check_eth_balance
+from utils.nonce_utils import NonceManager
+from utils.token_utils import is_weth, get_token_abi, check_and_approve_token
+from utils.balance_utils import AllowanceCache, PreTradeState, check_eth_balance, fetch_pre_trade_state
+
+
+logger = logging.getLogger(__name__)
+
+UNISWAP_V2_ROUTER = '0x7a250d5630B4cF539739dF2C5dAcb4c659F2488D'
+_ROUTER_ADDRESS = checksum_address(UNISWAP_V2_ROUTER)
+
+UNISWAP_V2_ROUTER_ABI = [
+    {
+        "inputs": [
+            {"internalType": "uint256", "name": "amountIn", "type": "uint256"},
+            {"internalType": "uint256", "name": "amountOutMin", "type": "uint256"},
+            {"internalType": "address[]", "name": "path", "type": "address[]"},
+            {"internalType": "address", "name": "to", "type": "address"},
+            {"internalType": "uint256", "name": "deadline", "type": "uint256"}
+        ],
+        "name": "swapExactTokensForTokens",
+        "outputs": [{"internalType": "uint256[]", "name": "amounts", "type": "uint256[]"}],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"internalType": "uint256", "name": "amountOutMin", "type": "uint256"},
+            {"internalType": "address[]", "name": "path", "type": "address[]"},
+            {"internalType": "address", "name": "to", "type": "address"},
+            {"internalType": "uint256", "name": "deadline", "type": "uint256"}
+        ],
+        "name": "swapExactETHForTokens",
+        "outputs": [{"internalType": "uint256[]", "name": "amounts", "type": "uint256[]"}],
+        "stateMutability": "payable",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"internalType": "uint256", "name": "amountIn", "type": "uint256"},
+            {"internalType": "uint256", "name": "amountOutMin", "type": "uint256"},
+            {"internalType": "address[]", "name": "path", "type": "address[]"},
+            {"internalType": "address", "name": "to", "type": "address"},
+            {"internalType": "uint256", "name": "deadline", "type": "uint256"}
+        ],
+        "name": "swapExactTokensForETH",
+        "outputs": [{"internalType": "uint256[]", "name": "amounts", "type": "uint256[]"}],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    }
+]
+
+
+@lru_cache(maxsize=4)
+def _router_contract(w3: Web3):
+    """Get the router contract for a Web3 instance, built once per instance."""
+    return w3.eth.contract(address=_ROUTER_ADDRESS, abi=UNISWAP_V2_ROUTER_ABI)
+
+
+# Selectors and argument encoders of the swap functions; calldata is ABI-encoded
+# directly in execute_swap. Encoders are looked up once here, and addresses are
+# passed to them as raw bytes so they are not re-validated as checksummed strings.
+SWAP_EXACT_TOKENS_FOR_TOKENS_SELECTOR = keccak(text='swapExactTokensForTokens(uint256,uint256,address[],address,uint256)')[:4]
+SWAP_EXACT_ETH_FOR_TOKENS_SELECTOR = keccak(text='swapExactETHForTokens(uint256,address[],address,uint256)')[:4]
+SWAP_EXACT_TOKENS_FOR_ETH_SELECTOR = keccak(text='swapExactTokensForETH(uint256,uint256,address[],address,uint256)')[:4]
+_ENCODE_EXACT_IN = registry.get_encoder('(uint256,uint256,address[],address,uint256)')
+_ENCODE_EXACT_ETH_IN = registry.get_encoder('(uint256,address[],address,uint256)')
 
 
 class UniswapV2Swapper:
     """Handles Uniswap V2 swap execution."""
     
-    UNISWAP_V2_ROUTER = '0x7a250d5630B4cF539739dF2C5dAcb4c659F2488D'
+    UNISWAP_V2_ROUTER = UNISWAP_V2_ROUTER
     
-    def __init__(self, w3: Web3, account, address: str, gas_manager: GasManager):
+    def __init__(self, w3: Web3, account, address: str, gas_manager: GasManager, nonce_manager: Optional[NonceManager] = None,
+                 allowance_cache: Optional[AllowanceCache] = None):
         """
         Initialize Uniswap V2 swapper.
         
@@ -26,62 +94,35 @@ class UniswapV2Swapper:
             account: Account object for signing transactions
             address: Wallet address
             gas_manager: GasManager instance
+            nonce_manager: NonceManager shared by everything sending from this wallet
+                (None to read the nonce from the node for every swap)
+            allowance_cache: AllowanceCache shared by everything sending from this wallet
+                (None to read the router allowance for every swap)
         """
         self.w3 = w3
         self.account = account
         self.address = address
+        self._address_bytes = address_bytes(address)
         self.gas_manager = gas_manager
+        self.nonce_manager = nonce_manager
+        self.allowance_cache = allowance_cache
+        
+        self.router_contract = _router_contract(w3)
+        self.router_address = _ROUTER_ADDRESS
+        self._chain_id = w3.eth.chain_id
         
-        router_address = to_checksum_address(self.UNISWAP_V2_ROUTER)
-        router_abi = self._get_router_abi()
-        self.router_contract = self.w3.eth.contract(
-            address=router_address,
-            abi=router_abi
-        )
-        self.router_address = router_address
+        # Fields shared by every swap transaction; execute_swap only adds the per-swap ones
+        self._tx_template = {
+            'from': address,
+            'to': self.router_address,
+            'chainId': self._chain_id,
+            'type': 2,
+            'gas': 300000
+        }
     
     def _get_router_abi(self):
         """Get Uniswap V2 router ABI."""
-        return [
-            {
-                "inputs": [
-                    {"internalType": "uint256", "name": "amountIn", "type": "uint256"},
-                    {"internalType": "uint256", "name": "amountOutMin", "type": "uint256"},
-                    {"internalType": "address[]", "name": "path", "type": "address[]"},
-                    {"internalType": "address", "name": "to", "type": "address"},
-                    {"internalType": "uint256", "name": "deadline", "type": "uint256"}
-                ],
-                "name": "swapExactTokensForTokens",
-                "outputs": [{"internalType": "uint256[]", "name": "amounts", "type": "uint256[]"}],
-                "stateMutability": "nonpayable",
-                "type": "function"
-            },
-            {
-                "inputs": [
-                    {"internalType": "uint256", "name": "amountOutMin", "type": "uint256"},
-                    {"internalType": "address[]", "name": "path", "type": "address[]"},
-                    {"internalType": "address", "name": "to", "type": "address"},
-                    {"internalType": "uint256", "name": "deadline", "type": "uint256"}
-                ],
-                "name": "swapExactETHForTokens",
-                "outputs": [{"internalType": "uint256[]", "name": "amounts", "type": "uint256[]"}],
-                "stateMutability": "payable",
-                "type": "function"
-            },
-            {
-                "inputs": [
-                    {"internalType": "uint256", "name": "amountIn", "type": "uint256"},
-                    {"internalType": "uint256", "name": "amountOutMin", "type": "uint256"},
-                    {"internalType": "address[]", "name": "path", "type": "address[]"},
-                    {"internalType": "address", "name": "to", "type": "address"},
-                    {"internalType": "uint256", "name": "deadline", "type": "uint256"}
-                ],
-                "name": "swapExactTokensForETH",
-                "outputs": [{"internalType": "uint256[]", "name": "amounts", "type": "uint256[]"}],
-                "stateMutability": "nonpayable",
-                "type": "function"
-            }
-        ]
+        return UNISWAP_V2_ROUTER_ABI
     
     
     def execute_swap(
@@ -91,7 +132,8 @@ class UniswapV2Swapper:
         amount_in: int,
         amount_out_min: int,
         deadline: int = None,
-        stream_gas_price_wei: Optional[int] = None
+        stream_gas_price_wei: Optional[int] = None,
+        pre_trade_state: Optional[PreTradeState] = None
     ) -> Optional[str]:
         """
         Execute swap on Uniswap V2.
@@ -102,6 +144,8 @@ class UniswapV2Swapper:
             amount_in: Amount to swap (in token's smallest unit)
             amount_out_min: Minimum amount out (in token's smallest unit)
             deadline: Transaction deadline timestamp (None for 20 minutes from now)
+            stream_gas_price_wei: Gas price from stream in Wei (optional)
+            pre_trade_state: Pre-fetched wallet state (None to fetch it in one batched read)
             
         Returns:
             Transaction hash or None if failed
@@ -109,11 +153,11 @@ class UniswapV2Swapper:
         if deadline is None:
             deadline = int(time.time()) + 1200  # 20 minutes
         
-        path = [to_checksum_address(token_in_address), to_checksum_address(token_out_address)]
+        path = [address_bytes(token_in_address), address_bytes(token_out_address)]
         
         # Determine swap function based on ETH involvement
-        is_eth_in = token_in_address.lower() == WETH_ADDRESS.lower()
-        is_eth_out = token_out_address.lower() == WETH_ADDRESS.lower()
+        is_eth_in = is_weth(token_in_address)
+        is_eth_out = is_weth(token_out_address)
         
         if is_eth_in:
             function_name = 'swapExactETHForTokens'
@@ -123,68 +167,63 @@ class UniswapV2Swapper:
             function_name = 'swapExactTokensForTokens'
         
         try:
-            gas_price = self.gas_manager.get_gas_price(stream_gas_price_wei=stream_gas_price_wei)
+            # Read balances, allowance, nonce and gas price in one round-trip
+            state = pre_trade_state
+            if state is None:
+                state = fetch_pre_trade_state(
+                    self.w3, self.address, self.gas_manager, stream_gas_price_wei,
+                    token_address=None if is_eth_in else token_in_address,
+                    spender=self.router_address,
+                    nonce_manager=self.nonce_manager,
+                    allowance_cache=self.allowance_cache
+                )
             
             # Check balances and approve if needed
             if function_name == 'swapExactETHForTokens':
-                if not check_eth_balance(amount_in, self.w3, self.address, self.gas_manager, stream_gas_price_wei):
+                if not check_eth_balance(amount_in, self.w3, self.address, self.gas_manager, stream_gas_price_wei, state):
                     return None
             else:
-                if not check_and_approve_token(token_in_address, self.router_address, amount_in, self.w3, self.account, self.address, self.gas_manager, stream_gas_price_wei):
+                if not check_and_approve_token(token_in_address, self.router_address, amount_in, self.w3, self.account, self.address, self.gas_manager, stream_gas_price_wei, state, self.allowance_cache, self._chain_id):
                     return None
             
-            # Get fresh nonce for swap transaction
-            nonce = self.w3.eth.get_transaction_count(self.address)
+            # Nonce for the swap (after any approval sent above)
+            nonce = state.next_nonce()
             
-            # Build swap transaction
+            # Build swap transaction (gas is fixed, so nothing needs estimating)
+            value = 0
             if function_name == 'swapExactETHForTokens':
-                transaction = self.router_contract.functions.swapExactETHForTokens(
-                    amount_out_min,
-                    path,
-                    self.address,
-                    deadline
-                ).build_transaction({
-                    'from': self.address,
-                    'value': amount_in,
-                    'gas': 300000,
-                    'gasPrice': gas_price,
-                    'nonce': nonce
-                })
+                data = SWAP_EXACT_ETH_FOR_TOKENS_SELECTOR + _ENCODE_EXACT_ETH_IN(
+                    (amount_out_min, path, self._address_bytes, deadline)
+                )
+                value = amount_in
             elif function_name == 'swapExactTokensForETH':
-                transaction = self.router_contract.functions.swapExactTokensForETH(
-                    amount_in,
-                    amount_out_min,
-                    path,
-                    self.address,
-                    deadline
-                ).build_transaction({
-                    'from': self.address,
-                    'gas': 300000,
-                    'gasPrice': gas_price,
-                    'nonce': nonce
-                })
+                data = SWAP_EXACT_TOKENS_FOR_ETH_SELECTOR + _ENCODE_EXACT_IN(
+                    (amount_in, amount_out_min, path, self._address_bytes, deadline)
+                )
             else:
-                transaction = self.router_contract.functions.swapExactTokensForTokens(
-                    amount_in,
-                    amount_out_min,
-                    path,
-                    self.address,
-                    deadline
-                ).build_transaction({
-                    'from': self.address,
-                    'gas': 300000,
-                    'gasPrice': gas_price,
-                    'nonce': nonce
-                })
+                data = SWAP_EXACT_TOKENS_FOR_TOKENS_SELECTOR + _ENCODE_EXACT_IN(
+                    (amount_in, amount_out_min, path, self._address_bytes, deadline)
+                )
+            transaction = dict(self._tx_template)
+            transaction['nonce'] = nonce
+            transaction['data'] = data
+            transaction['value'] = value
+            transaction['maxFeePerGas'] = state.gas_price
+            transaction['maxPriorityFeePerGas'] = state.max_priority_fee
             
             # Sign and send transaction
             signed_txn = self.account.sign_transaction(transaction)
             tx_hash = self.w3.eth.send_raw_transaction(signed_txn.raw_transaction)
-            print(f"  Swap tx: {tx_hash.hex()}")
+            if self.allowance_cache is not None and not is_eth_in:
+                self.allowance_cache.spend(token_in_address, self.router_address, amount_in)
+            logger.info("  Swap tx: %s", tx_hash.hex())
             return tx_hash.hex()
             
         except Exception as e:
-            print(f"  ERROR: Error executing swap: {str(e)}")
-            print(f"  Traceback: {traceback.format_exc()}")
+            # The traceback is only formatted if a handler emits the record
+            logger.exception("  ERROR: Error executing swap: %s", e)
+            if self.nonce_manager is not None:
+                # A reserved nonce may not have been used; reload it from the node
+                self.nonce_manager.resync()
             return None
 
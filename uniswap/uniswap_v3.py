@@ -2,22 +2,72 @@
 Uniswap V3 swap execution logic.
 """
 
+import logging
 import time
-import traceback
+from functools import lru_cache
 from typing import Optional
 from web3 import Web3
-from eth_utils import to_checksum_address
+from eth_abi.registry import registry
+from eth_utils import keccak
+from utils.address_utils import address_bytes, checksum_address
 from utils.gas_utils import GasManager
-from utils.token_utils import WETH_ADDRESS, get_token_abi, check_and_approve_token
-from utils.balance_utils import check_eth_balance
+from utils.nonce_utils import NonceManager
+from utils.token_utils import is_weth, get_token_abi, check_and_approve_token
+from utils.balance_utils import AllowanceCache, PreTradeState, check_eth_balance, fetch_pre_trade_state
+
+
+logger = logging.getLogger(__name__)
+
+UNISWAP_V3_ROUTER = '0xE592427A0AEce92De3Edee1F18E0157C05861564'
+_ROUTER_ADDRESS = checksum_address(UNISWAP_V3_ROUTER)
+
+UNISWAP_V3_ROUTER_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "tokenIn", "type": "address"},
+                    {"internalType": "address", "name": "tokenOut", "type": "address"},
+                    {"internalType": "uint24", "name": "fee", "type": "uint24"},
+                    {"internalType": "address", "name": "recipient", "type": "address"},
+                    {"internalType": "uint256", "name": "deadline", "type": "uint256"},
+                    {"internalType": "uint256", "name": "amountIn", "type": "uint256"},
+                    {"internalType": "uint256", "name": "amountOutMinimum", "type": "uint256"},
+                    {"internalType": "uint160", "name": "sqrtPriceLimitX96", "type": "uint160"}
+                ],
+                "internalType": "struct ISwapRouter.ExactInputSingleParams",
+                "name": "params",
+                "type": "tuple"
+            }
+        ],
+        "name": "exactInputSingle",
+        "outputs": [{"internalType": "uint256", "name": "amountOut", "type": "uint256"}],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
+
+@lru_cache(maxsize=4)
+def _router_contract(w3: Web3):
+    """Get the router contract for a Web3 instance, built once per instance."""
+    return w3.eth.contract(address=_ROUTER_ADDRESS, abi=UNISWAP_V3_ROUTER_ABI)
+
+
+# Selector and argument encoder of exactInputSingle; calldata is ABI-encoded
+# directly in execute_swap. The encoder is looked up once here, and addresses are
+# passed to it as raw bytes so they are not re-validated as checksummed strings.
+EXACT_INPUT_SINGLE_SELECTOR = keccak(text='exactInputSingle((address,address,uint24,address,uint256,uint256,uint256,uint160))')[:4]
+_ENCODE_EXACT_INPUT_SINGLE = registry.get_encoder('((address,address,uint24,address,uint256,uint256,uint256,uint160))')
 
 
 class UniswapV3Swapper:
     """Handles Uniswap V3 swap execution."""
     
-    UNISWAP_V3_ROUTER = '0xE592427A0AEce92De3Edee1F18E0157C05861564'
+    UNISWAP_V3_ROUTER = UNISWAP_V3_ROUTER
     
-    def __init__(self, w3: Web3, account, address: str, gas_manager: GasManager):
+    def __init__(self, w3: Web3, account, address: str, gas_manager: GasManager, nonce_manager: Optional[NonceManager] = None,
+                 allowance_cache: Optional[AllowanceCache] = None):
         """
         Initialize Uniswap V3 swapper.
         
@@ -26,47 +76,35 @@ class UniswapV3Swapper:
             account: Account object for signing transactions
             address: Wallet address
             gas_manager: GasManager instance
+            nonce_manager: NonceManager shared by everything sending from this wallet
+                (None to read the nonce from the node for every swap)
+            allowance_cache: AllowanceCache shared by everything sending from this wallet
+                (None to read the router allowance for every swap)
         """
         self.w3 = w3
         self.account = account
         self.address = address
+        self._address_bytes = address_bytes(address)
         self.gas_manager = gas_manager
+        self.nonce_manager = nonce_manager
+        self.allowance_cache = allowance_cache
         
-        router_address = to_checksum_address(self.UNISWAP_V3_ROUTER)
-        router_abi = self._get_router_abi()
-        self.router_contract = self.w3.eth.contract(
-            address=router_address,
-            abi=router_abi
-        )
-        self.router_address = router_address
+        self.router_contract = _router_contract(w3)
+        self.router_address = _ROUTER_ADDRESS
+        self._chain_id = w3.eth.chain_id
+        
+        # Fields shared by every swap transaction; execute_swap only adds the per-swap ones
+        self._tx_template = {
+            'from': address,
+            'to': self.router_address,
+            'chainId': self._chain_id,
+            'type': 2,
+            'gas': 300000
+        }
     
     def _get_router_abi(self):
         """Get Uniswap V3 router ABI (exactInputSingle)."""
-        return [
-            {
-                "inputs": [
-                    {
-                        "components": [
-                            {"internalType": "address", "name": "tokenIn", "type": "address"},
-                            {"internalType": "address", "name": "tokenOut", "type": "address"},
-                            {"internalType": "uint24", "name": "fee", "type": "uint24"},
-                            {"internalType": "address", "name": "recipient", "type": "address"},
-                            {"internalType": "uint256", "name": "deadline", "type": "uint256"},
-                            {"internalType": "uint256", "name": "amountIn", "type": "uint256"},
-                            {"internalType": "uint256", "name": "amountOutMinimum", "type": "uint256"},
-                            {"internalType": "uint160", "name": "sqrtPriceLimitX96", "type": "uint160"}
-                        ],
-                        "internalType": "struct ISwapRouter.ExactInputSingleParams",
-                        "name": "params",
-                        "type": "tuple"
-                    }
-                ],
-                "name": "exactInputSingle",
-                "outputs": [{"internalType": "uint256", "name": "amountOut", "type": "uint256"}],
-                "stateMutability": "payable",
-                "type": "function"
-            }
-        ]
+        return UNISWAP_V3_ROUTER_ABI
     
     
     def execute_swap(
@@ -77,7 +115,8 @@ class UniswapV3Swapper:
         amount_out_min: int,
         fee: int = 3000,
         deadline: int = None,
-        stream_gas_price_wei: Optional[int] = None
+        stream_gas_price_wei: Optional[int] = None,
+        pre_trade_state: Optional[PreTradeState] = None
     ) -> Optional[str]:
         """
         Execute swap on Uniswap V3.
@@ -89,6 +128,8 @@ class UniswapV3Swapper:
             amount_out_min: Minimum amount out (in token's smallest unit)
             fee: Pool fee in basis points (3000 = 0.3%)
             deadline: Transaction deadline timestamp
+            stream_gas_price_wei: Gas price from stream in Wei (optional)
+            pre_trade_state: Pre-fetched wallet state (None to fetch it in one batched read)
             
         Returns:
             Transaction hash or None if failed
@@ -97,52 +138,68 @@ class UniswapV3Swapper:
             deadline = int(time.time()) + 1200  # 20 minutes
         
         try:
-            gas_price = self.gas_manager.get_gas_price(stream_gas_price_wei=stream_gas_price_wei)
+            is_eth_in = is_weth(token_in_address)
             
-            # Print token addresses for debugging
-            print(f"  Executing swap - Token In: {token_in_address}, Token Out: {token_out_address}")
+            # Read balances, allowance, nonce and gas price in one round-trip
+            state = pre_trade_state
+            if state is None:
+                state = fetch_pre_trade_state(
+                    self.w3, self.address, self.gas_manager, stream_gas_price_wei,
+                    token_address=None if is_eth_in else token_in_address,
+                    spender=self.router_address,
+                    nonce_manager=self.nonce_manager,
+                    allowance_cache=self.allowance_cache
+                )
+            
+            logger.debug("  Executing swap - Token In: %s, Token Out: %s", token_in_address, token_out_address)
             
             # Check balances and approve if needed
-            is_eth_in = token_in_address.lower() == WETH_ADDRESS.lower()
             if is_eth_in:
-                print(f"  Token In is WETH/ETH")
-                if not check_eth_balance(amount_in, self.w3, self.address, self.gas_manager, stream_gas_price_wei):
+                logger.debug("  Token In is WETH/ETH")
+                if not check_eth_balance(amount_in, self.w3, self.address, self.gas_manager, stream_gas_price_wei, state):
                     return None
             else:
-                print(f"  Token In is ERC20 token")
-                if not check_and_approve_token(token_in_address, self.router_address, amount_in, self.w3, self.account, self.address, self.gas_manager, stream_gas_price_wei):
+                logger.debug("  Token In is ERC20 token")
+                if not check_and_approve_token(token_in_address, self.router_address, amount_in, self.w3, self.account, self.address, self.gas_manager, stream_gas_price_wei, state, self.allowance_cache, self._chain_id):
                     return None
             
-            # Get fresh nonce for swap transaction
-            nonce = self.w3.eth.get_transaction_count(self.address)
+            # Nonce for the swap (after any approval sent above)
+            nonce = state.next_nonce()
             
-            params = {
-                'tokenIn': to_checksum_address(token_in_address),
-                'tokenOut': to_checksum_address(token_out_address),
-                'fee': fee,
-                'recipient': self.address,
-                'deadline': deadline,
-                'amountIn': amount_in,
-                'amountOutMinimum': amount_out_min,
-                'sqrtPriceLimitX96': 0
-            }
+            # ExactInputSingleParams: tokenIn, tokenOut, fee, recipient, deadline,
+            # amountIn, amountOutMinimum, sqrtPriceLimitX96
+            params = (
+                address_bytes(token_in_address),
+                address_bytes(token_out_address),
+                fee,
+                self._address_bytes,
+                deadline,
+                amount_in,
+                amount_out_min,
+                0
+            )
             
-            transaction = self.router_contract.functions.exactInputSingle(params).build_transaction({
-                'from': self.address,
-                'gas': 300000,
-                'gasPrice': gas_price,
-                'nonce': nonce,
-                'value': amount_in if is_eth_in else 0
-            })
+            # Gas is fixed, so the transaction is assembled directly without estimation
+            transaction = dict(self._tx_template)
+            transaction['nonce'] = nonce
+            transaction['data'] = EXACT_INPUT_SINGLE_SELECTOR + _ENCODE_EXACT_INPUT_SINGLE((params,))
+            transaction['value'] = amount_in if is_eth_in else 0
+            transaction['maxFeePerGas'] = state.gas_price
+            transaction['maxPriorityFeePerGas'] = state.max_priority_fee
             
             signed_txn = self.account.sign_transaction(transaction)
             tx_hash = self.w3.eth.send_raw_transaction(signed_txn.raw_transaction)
-            print(f"  Swap tx: {tx_hash.hex()}")
+            if self.allowance_cache is not None and not is_eth_in:
+                self.allowance_cache.spend(token_in_address, self.router_address, amount_in)
+            logger.info("  Swap tx: %s", tx_hash.hex())
             
             return tx_hash.hex()
             
         except Exception as e:
-            print(f"  ERROR: Error executing V3 swap: {str(e)}")
-            print(f"  Traceback: {traceback.format_exc()}")
+            # The traceback is only formatted if a handler emits the record
+            logger.exception("  ERROR: Error executing V3 swap: %s", e)
+            if self.nonce_manager is not None:
+                # A reserved nonce may not have been used; reload it from the node
+                self.nonce_manager.resync()
             return None
 
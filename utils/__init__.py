@@ -2,31 +2,54 @@
 Utility modules for DEX trading.
 """
 
-from .protobuf_utils import protobuf_to_dict, convert_hex_to_int, convert_bytes
+from .protobuf_utils import protobuf_to_dict, protobuf_to_dict_int, convert_hex_to_int, convert_bytes
 from .price_utils import get_price_for_slippage, get_best_slippage_bps
-from .token_utils import get_token_address, get_token_balance, WETH_ADDRESS, get_token_abi, check_and_approve_token
+from .token_utils import get_token_address, get_token_balance, get_token_balances_multi, WETH_ADDRESS, is_weth, get_token_abi, get_token_contract, check_and_approve_token
 from .gas_utils import GasManager, extract_gas_from_stream
-from .balance_utils import check_eth_balance
+from .balance_utils import check_eth_balance, AllowanceCache, PreTradeState, fetch_pre_trade_state
 from .conversion_utils import convert_amount_to_smallest_unit, calculate_amount_out_min, convert_amount_from_smallest_unit
-from .transaction_utils import calculate_actual_amount_out
+from .transaction_utils import AMOUNT_MEASURED, AMOUNT_FALLBACK_ERROR, AMOUNT_FALLBACK_LOW, calculate_actual_amount_out, calculate_actual_amount_out_batch, calculate_actual_amount_out_wei
+from .logging_utils import setup_logging
+from .multicall_utils import MULTICALL3_ADDRESS, aggregate3
+from .address_utils import checksum_address, address_bytes, is_hex_address
+from .nonce_utils import NonceManager
 
 __all__ = [
     'protobuf_to_dict',
+    'protobuf_to_dict_int',
     'convert_hex_to_int',
     'convert_bytes',
     'get_price_for_slippage',
     'get_best_slippage_bps',
     'get_token_address',
     'get_token_balance',
+    'get_token_balances_multi',
     'WETH_ADDRESS',
+    'is_weth',
     'get_token_abi',
+    'get_token_contract',
     'check_and_approve_token',
     'GasManager',
     'extract_gas_from_stream',
     'check_eth_balance',
+    'AllowanceCache',
+    'PreTradeState',
+    'fetch_pre_trade_state',
     'convert_amount_to_smallest_unit',
     'calculate_amount_out_min',
     'convert_amount_from_smallest_unit',
+    'AMOUNT_MEASURED',
+    'AMOUNT_FALLBACK_ERROR',
+    'AMOUNT_FALLBACK_LOW',
     'calculate_actual_amount_out',
+    'calculate_actual_amount_out_batch',
+    'calculate_actual_amount_out_wei',
+    'setup_logging',
+    'MULTICALL3_ADDRESS',
+    'aggregate3',
+    'checksum_address',
+    'address_bytes',
+    'is_hex_address',
+    'NonceManager',
 ]
 
@@ -0,0 +1,66 @@
+"""
+Address utilities.
+"""
+
+import re
+from functools import lru_cache
+from eth_utils import to_checksum_address
+
+# 0x followed by exactly 40 hex digits; fullmatch runs in C without backtracking
+_HEX_ADDRESS = re.compile(r'0x[0-9a-fA-F]{40}')
+
+
+def is_hex_address(address: str) -> bool:
+    """
+    Check that a string is a 0x-prefixed 20-byte hex address.
+
+    This is a cheap precheck before checksumming, so malformed stream values are
+    rejected without raising from inside eth_utils.
+
+    Args:
+        address: Candidate address string
+
+    Returns:
+        True if the string is 0x followed by 40 hex digits
+    """
+    return _HEX_ADDRESS.fullmatch(address) is not None
+
+
+@lru_cache(maxsize=8192)
+def checksum_address(address: str) -> str:
+    """
+    Checksum an address, memoizing the result.
+
+    Checksumming hashes the address with keccak256. The same pool tokens and
+    routers recur on every trade, so repeated addresses are served from the cache.
+
+    Args:
+        address: Hex address (any case)
+
+    Returns:
+        EIP-55 checksummed address
+
+    Raises:
+        ValueError: If the address is not a valid 20-byte hex address
+    """
+    return to_checksum_address(address)
+
+
+@lru_cache(maxsize=4096)
+def address_bytes(address: str) -> bytes:
+    """
+    Get the raw 20 bytes of an address, memoizing the result.
+
+    Comparing the bytes avoids lowercasing both address strings for every
+    comparison; the conversion itself is served from the cache.
+
+    Args:
+        address: Hex address (any case, with 0x prefix)
+
+    Returns:
+        Address as 20 raw bytes
+
+    Raises:
+        ValueError: If the address is not valid hex
+    """
+    return bytes.fromhex(address[2:])
@@ -2,11 +2,231 @@
 Balance checking utilities.
 """
 
-from typing import Optional, TYPE_CHECKING
+import logging
+import threading
+from typing import Dict, Optional, Tuple, TYPE_CHECKING
+from utils.address_utils import address_bytes, checksum_address
+from utils.multicall_utils import MULTICALL3_ADDRESS, aggregate3, decode_uint256, encode_get_eth_balance
+from utils.token_utils import encode_balance_of, encode_allowance, get_token_contract
 
 if TYPE_CHECKING:
     from web3 import Web3
     from utils.gas_utils import GasManager
+    from utils.nonce_utils import NonceManager
+
+logger = logging.getLogger(__name__)
+
+
+class AllowanceCache:
+    """Tracks the wallet's ERC20 allowances locally so they are not read before every swap."""
+
+    def __init__(self):
+        """
+        Initialize allowance cache.
+
+        Only the owner can change its allowances, so after one read the value is
+        kept current from our own approvals and swaps. Spends are subtracted even
+        for tokens that keep max approvals constant, which only underestimates.
+        """
+        self._allowances: Dict[Tuple[bytes, bytes], int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, token_address: str, spender: str) -> Optional[int]:
+        """
+        Get the cached allowance.
+
+        Args:
+            token_address: Token contract address
+            spender: Spender (router) address
+
+        Returns:
+            Allowance in the token's smallest unit, or None if not cached
+        """
+        return self._allowances.get((address_bytes(token_address), address_bytes(spender)))
+
+    def set(self, token_address: str, spender: str, allowance: int):
+        """
+        Record an allowance read from the node or set by an approval.
+
+        Args:
+            token_address: Token contract address
+            spender: Spender (router) address
+            allowance: Allowance in the token's smallest unit
+        """
+        with self._lock:
+            self._allowances[(address_bytes(token_address), address_bytes(spender))] = allowance
+
+    def spend(self, token_address: str, spender: str, amount: int):
+        """
+        Subtract an amount sent to the spender from the cached allowance.
+
+        Args:
+            token_address: Token contract address
+            spender: Spender (router) address
+            amount: Amount in the token's smallest unit
+        """
+        key = (address_bytes(token_address), address_bytes(spender))
+        with self._lock:
+            allowance = self._allowances.get(key)
+            if allowance is not None:
+                self._allowances[key] = max(allowance - amount, 0)
+
+    def invalidate(self, token_address: str, spender: str):
+        """
+        Forget a cached allowance so it is read from the node next time.
+
+        Args:
+            token_address: Token contract address
+            spender: Spender (router) address
+        """
+        with self._lock:
+            self._allowances.pop((address_bytes(token_address), address_bytes(spender)), None)
+
+
+class PreTradeState:
+    """Wallet state read before a swap, so the checks and the swap itself make no further reads."""
+
+    def __init__(
+        self,
+        eth_balance: int,
+        nonce: Optional[int],
+        gas_price: int,
+        token_balance: Optional[int] = None,
+        allowance: Optional[int] = None,
+        max_priority_fee: Optional[int] = None,
+        nonce_manager: Optional['NonceManager'] = None
+    ):
+        """
+        Initialize pre-trade state.
+
+        Args:
+            eth_balance: Wallet ETH balance in Wei
+            nonce: Next nonce read from the node (None when nonce_manager is used)
+            gas_price: Max fee per gas in Wei (the gas price for legacy transactions)
+            token_balance: Balance of the input token (None if not an ERC20 swap)
+            allowance: Router allowance of the input token (None if not an ERC20 swap)
+            max_priority_fee: Max priority fee per gas in Wei (None for legacy transactions)
+            nonce_manager: NonceManager to reserve nonces from (optional)
+        """
+        self.eth_balance = eth_balance
+        self.nonce = nonce
+        self.gas_price = gas_price
+        self.max_priority_fee = max_priority_fee
+        self.token_balance = token_balance
+        self.allowance = allowance
+        self.nonce_manager = nonce_manager
+
+    def next_nonce(self) -> int:
+        """
+        Get the nonce for the next transaction sent with this state.
+
+        Returns:
+            Nonce reserved from the nonce manager, or the tracked node nonce
+        """
+        if self.nonce_manager is not None:
+            return self.nonce_manager.reserve()
+        nonce = self.nonce
+        self.nonce += 1
+        return nonce
+
+
+def fetch_pre_trade_state(
+    w3: 'Web3',
+    address: str,
+    gas_manager: 'GasManager',
+    stream_gas_price_wei: Optional[int] = None,
+    token_address: Optional[str] = None,
+    spender: Optional[str] = None,
+    nonce_manager: Optional['NonceManager'] = None,
+    allowance_cache: Optional[AllowanceCache] = None
+) -> PreTradeState:
+    """
+    Read everything a swap needs from the node in one round-trip.
+
+    ETH balance, nonce (unless a nonce manager tracks it) and, for ERC20 input,
+    the token balance and router allowance (unless cached) are sent as a single JSON-RPC batch,
+    together with eth_feeHistory when the gas manager's fee cache has expired. If
+    the provider rejects batches, the balance and allowance reads are combined into
+    one Multicall3 call instead and fees are read separately.
+
+    Args:
+        w3: Web3 instance
+        address: Wallet address
+        gas_manager: GasManager instance
+        stream_gas_price_wei: Gas price from stream in Wei (optional)
+        token_address: Input token address (None when swapping ETH)
+        spender: Router address the allowance is checked for
+        nonce_manager: NonceManager to take nonces from instead of reading the nonce
+        allowance_cache: AllowanceCache to take the allowance from when it is cached
+
+    Returns:
+        PreTradeState with the values read
+    """
+    check_token = token_address is not None and spender is not None
+    read_nonce = nonce_manager is None
+    read_fees = gas_manager.fee_history_stale()
+    nonce = None
+    token_balance = None
+    allowance = None
+    if check_token and allowance_cache is not None:
+        allowance = allowance_cache.get(token_address, spender)
+    read_allowance = check_token and allowance is None
+
+    try:
+        with w3.batch_requests() as batch:
+            batch.add(w3.eth.get_balance(address))
+            if read_nonce:
+                batch.add(w3.eth.get_transaction_count(address))
+            if check_token:
+                token_contract = get_token_contract(w3, checksum_address(token_address))
+                batch.add(token_contract.functions.balanceOf(address))
+                if read_allowance:
+                    batch.add(token_contract.functions.allowance(address, spender))
+            if read_fees:
+                batch.add(w3.eth.fee_history(*gas_manager.fee_history_params()))
+            results = list(batch.execute())
+        eth_balance = results.pop(0)
+        if read_nonce:
+            nonce = results.pop(0)
+        if check_token:
+            token_balance = results.pop(0)
+        if read_allowance:
+            allowance = results.pop(0)
+        if read_fees:
+            gas_manager.update_fee_history(results.pop(0))
+    except Exception as e:
+        # Provider without batch support: one multicall for the balance/allowance reads
+        logger.warning("  WARNING: Batch RPC failed (%s), falling back to Multicall3", e)
+        calls = [(MULTICALL3_ADDRESS, encode_get_eth_balance(address))]
+        if check_token:
+            token = checksum_address(token_address)
+            calls.append((token, encode_balance_of(address)))
+            if read_allowance:
+                calls.append((token, encode_allowance(address, spender)))
+        results = aggregate3(w3, calls)
+        eth_balance = decode_uint256(*results[0])
+        if eth_balance is None:
+            eth_balance = w3.eth.get_balance(address)
+        if check_token:
+            token_balance = decode_uint256(*results[1])
+        if read_allowance:
+            allowance = decode_uint256(*results[2])
+        if read_nonce:
+            nonce = w3.eth.get_transaction_count(address)
+
+    if read_allowance and allowance is not None and allowance_cache is not None:
+        allowance_cache.set(token_address, spender, allowance)
+
+    max_fee, max_priority_fee = gas_manager.get_max_fees(stream_gas_price_wei=stream_gas_price_wei)
+    return PreTradeState(
+        eth_balance=eth_balance,
+        nonce=nonce,
+        gas_price=max_fee,
+        token_balance=token_balance,
+        allowance=allowance,
+        max_priority_fee=max_priority_fee,
+        nonce_manager=nonce_manager
+    )
 
 
 def check_eth_balance(
@@ -14,23 +234,29 @@ def check_eth_balance(
     w3: 'Web3',
     address: str,
     gas_manager: 'GasManager',
-    stream_gas_price_wei: Optional[int] = None
+    stream_gas_price_wei: Optional[int] = None,
+    state: Optional[PreTradeState] = None
 ) -> bool:
     """
     Check if sufficient ETH balance for swap and gas.
-    
+
     Args:
         amount_in: Amount of ETH needed for swap
         w3: Web3 instance
         address: Wallet address
         gas_manager: GasManager instance
         stream_gas_price_wei: Gas price from stream in Wei (optional)
-        
+        state: Pre-fetched wallet state (optional, avoids the gas price and balance reads)
+
     Returns:
         True if sufficient balance, False otherwise
     """
-    gas_price = gas_manager.get_gas_price(stream_gas_price_wei=stream_gas_price_wei)
-    balance_wei = w3.eth.get_balance(address)
+    if state is not None:
+        gas_price = state.gas_price
+        balance_wei = state.eth_balance
+    else:
+        gas_price = gas_manager.get_gas_price(stream_gas_price_wei=stream_gas_price_wei)
+        balance_wei = w3.eth.get_balance(address)
     estimated_gas_cost = gas_price * 300000
     total_needed = amount_in + estimated_gas_cost
     if balance_wei < total_needed:
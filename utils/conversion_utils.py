@@ -2,8 +2,45 @@
 Amount conversion utilities for token amounts and slippage calculations.
 """
 
-from typing import Dict
-from decimal import Decimal
+from typing import Dict, Tuple
+
+# Powers of ten up to 10**77 (the largest power below 2**256)
+POW10 = tuple(10 ** i for i in range(78))
+
+
+def _pow10(exponent: int) -> int:
+    """Get 10**exponent, from the POW10 table when in range."""
+    return POW10[exponent] if exponent < 78 else 10 ** exponent
+
+
+def _decimal_digits(value: float) -> Tuple[int, int]:
+    """
+    Split a number into integer digits and a power-of-ten exponent.
+    
+    Floats are split from their shortest repr, the same digits Decimal(str(value))
+    would hold, so value == digits * 10**exponent exactly in decimal terms.
+    
+    Args:
+        value: Float or int
+        
+    Returns:
+        Tuple of (digits, exponent)
+    """
+    if isinstance(value, int):
+        return value, 0
+    mantissa, _, exponent = repr(float(value)).partition('e')
+    whole, _, fraction = mantissa.partition('.')
+    return int(whole + fraction), (int(exponent) if exponent else 0) - len(fraction)
+
+
+def _scale_truncate(digits: int, exponent: int) -> int:
+    """Compute digits * 10**exponent truncated toward zero, as int(Decimal) does."""
+    if exponent >= 0:
+        return digits * _pow10(exponent)
+    divisor = _pow10(-exponent)
+    if digits >= 0:
+        return digits // divisor
+    return -(-digits // divisor)
 
 
 def convert_amount_to_smallest_unit(amount: float, decimals: int) -> int:
@@ -17,12 +54,15 @@ def convert_amount_to_smallest_unit(amount: float, decimals: int) -> int:
     Returns:
         Amount in smallest unit (wei/smallest denomination)
     """
-    return int(Decimal(str(amount)) * (Decimal(10) ** decimals))
+    if isinstance(amount, int):
+        return amount * _pow10(decimals)
+    digits, exponent = _decimal_digits(amount)
+    return _scale_truncate(digits, exponent + decimals)
 
 
 def calculate_amount_out_min(
     amount_in: float,
-    price: Decimal,
+    price: float,
     decimals_out: int,
     slippage_bps: int
 ) -> int:
@@ -38,10 +78,12 @@ def calculate_amount_out_min(
     Returns:
         Minimum amount out in smallest unit
     """
-    expected_out = Decimal(str(amount_in)) * price
-    slippage_multiplier = Decimal('1') - (Decimal(str(slippage_bps)) / Decimal('10000'))
-    amount_out_min = expected_out * slippage_multiplier
-    return int(amount_out_min * (Decimal(10) ** decimals_out))
+    # amount_in * price * (10000 - bps) / 10000 scaled to the smallest unit, in
+    # integers only; floor division matches truncating the exact decimal product
+    amount_digits, amount_exponent = _decimal_digits(amount_in)
+    price_digits, price_exponent = _decimal_digits(price)
+    numerator = amount_digits * price_digits * (10000 - slippage_bps)
+    return _scale_truncate(numerator, amount_exponent + price_exponent + decimals_out - 4)
 
 
 def convert_amount_from_smallest_unit(amount_wei: int, decimals: int) -> float:
@@ -55,4 +97,5 @@ def convert_amount_from_smallest_unit(amount_wei: int, decimals: int) -> float:
     Returns:
         Amount in human-readable units
     """
-    return float(Decimal(amount_wei) / (Decimal(10) ** decimals))
+    # int / int true division is correctly rounded to the nearest float
+    return amount_wei / _pow10(decimals)
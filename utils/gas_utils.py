@@ -2,9 +2,19 @@
 Gas price management utilities.
 """
 
-from typing import Dict, Optional
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
 from web3 import Web3
 
+logger = logging.getLogger(__name__)
+
+# Priority fee used when fee history has no reward data
+DEFAULT_PRIORITY_FEE_WEI = 1_000_000_000
+
+# Gas price used when the RPC gas price cannot be fetched (30 Gwei)
+FALLBACK_GAS_PRICE_WEI = 30_000_000_000
+
 
 class GasManager:
     """Manages gas price calculations and limits."""
@@ -13,7 +23,9 @@ class GasManager:
         self,
         w3: Web3,
         gas_price_gwei: Optional[float] = None,
-        max_gas_price_gwei: float = 200
+        max_gas_price_gwei: float = 200,
+        priority_fee_percentile: int = 50,
+        fee_cache_ttl: float = 1.0
     ):
         """
         Initialize gas manager.
@@ -22,10 +34,106 @@ class GasManager:
             w3: Web3 instance
             gas_price_gwei: Fixed gas price in Gwei (None to use network price)
             max_gas_price_gwei: Maximum gas price in Gwei
+            priority_fee_percentile: Reward percentile of the last block used as priority fee
+            fee_cache_ttl: Seconds to reuse the last fee history (blocks arrive every ~12s)
         """
         self.w3 = w3
         self.gas_price_gwei = gas_price_gwei
         self.max_gas_price_gwei = max_gas_price_gwei
+        self.priority_fee_percentile = priority_fee_percentile
+        self.fee_cache_ttl = fee_cache_ttl
+        # Gwei settings converted once; to_wei goes through unit lookup and Decimal
+        self._max_gas_price_wei = w3.to_wei(max_gas_price_gwei, 'gwei')
+        self._fixed_gas_price_wei = w3.to_wei(gas_price_gwei, 'gwei') if gas_price_gwei else None
+        self._fee_cache = (0, 0, float('-inf'))  # (base fee, tip, monotonic time fetched)
+    
+    def fee_history_stale(self) -> bool:
+        """
+        Check whether the cached fee history is older than fee_cache_ttl.
+        
+        Callers that batch RPC reads use this to decide whether to add an
+        eth_feeHistory request (see fee_history_params) to their batch.
+        
+        Returns:
+            True if get_1559_fees would make an RPC call
+        """
+        return time.monotonic() - self._fee_cache[2] >= self.fee_cache_ttl
+    
+    def fee_history_params(self) -> Tuple[int, str, List[int]]:
+        """
+        Get the eth_feeHistory arguments used for fee estimation.
+        
+        Returns:
+            Tuple of (block count, newest block, reward percentiles)
+        """
+        return 1, 'latest', [self.priority_fee_percentile]
+    
+    def update_fee_history(self, history: Dict) -> Tuple[int, int]:
+        """
+        Cache the fees from an eth_feeHistory result fetched elsewhere.
+        
+        Args:
+            history: Result of eth_feeHistory called with fee_history_params()
+        
+        Returns:
+            Tuple of (base fee, priority fee) in Wei
+        """
+        # baseFeePerGas has one extra entry: the base fee of the next block
+        base_fee = history['baseFeePerGas'][-1]
+        rewards = history.get('reward') or []
+        tip = rewards[0][0] if rewards and rewards[0] else DEFAULT_PRIORITY_FEE_WEI
+        self._fee_cache = (base_fee, tip, time.monotonic())
+        return base_fee, tip
+    
+    def get_1559_fees(self) -> Tuple[int, int]:
+        """
+        Get the next block's base fee and a priority fee from eth_feeHistory.
+        
+        The result is reused for fee_cache_ttl seconds.
+        
+        Returns:
+            Tuple of (base fee, priority fee) in Wei
+        """
+        if not self.fee_history_stale():
+            base_fee, tip, _ = self._fee_cache
+            return base_fee, tip
+        return self.update_fee_history(self.w3.eth.fee_history(*self.fee_history_params()))
+    
+    def get_max_fees(self, stream_gas_price_wei: Optional[int] = None) -> Tuple[int, int]:
+        """
+        Get maxFeePerGas and maxPriorityFeePerGas for a type-2 transaction.
+        
+        The max fee leaves room for the base fee to double (2 * base fee + tip). A
+        stream gas price raises it, a fixed gas price replaces it, and it is always
+        capped at max_gas_price_gwei.
+        
+        Args:
+            stream_gas_price_wei: Gas price from stream in Wei (optional)
+        
+        Returns:
+            Tuple of (max fee per gas, max priority fee per gas) in Wei
+        """
+        max_gas_price = self._max_gas_price_wei
+        try:
+            base_fee, tip = self.get_1559_fees()
+        except Exception as e:
+            # Fee history unavailable: use the legacy gas price as the fee ceiling
+            max_fee = self.get_gas_price(stream_gas_price_wei=stream_gas_price_wei)
+            logger.warning("[GAS] Fee history unavailable (%s), using gas price as max fee", e)
+            return max_fee, min(DEFAULT_PRIORITY_FEE_WEI, max_fee)
+        
+        if self._fixed_gas_price_wei is not None:
+            max_fee = self._fixed_gas_price_wei
+        else:
+            max_fee = 2 * base_fee + tip
+            if stream_gas_price_wei is not None:
+                max_fee = max(max_fee, stream_gas_price_wei)
+        if max_fee > max_gas_price:
+            logger.info("[GAS] Max fee capped: %.2f Gwei -> %s Gwei", max_fee / 1e9, self.max_gas_price_gwei)
+            max_fee = max_gas_price
+        tip = min(tip, max_fee)
+        logger.info("[GAS] EIP-1559 fees: base %.2f Gwei, tip %.2f Gwei, max %.2f Gwei", base_fee / 1e9, tip / 1e9, max_fee / 1e9)
+        return max_fee, tip
     
     def get_gas_price(self, stream_gas_price_wei: Optional[int] = None) -> int:
         """
@@ -38,34 +146,32 @@ class GasManager:
             Gas price in Wei
         """
         # Priority 1: Use gas price from stream if provided
+        max_gas_price = self._max_gas_price_wei
         if stream_gas_price_wei is not None:
-            max_gas_price = self.w3.to_wei(self.max_gas_price_gwei, 'gwei')
             if stream_gas_price_wei > max_gas_price:
-                print(f"[GAS] Using stream gas price (capped): {stream_gas_price_wei / 1e9:.2f} Gwei -> {self.max_gas_price_gwei} Gwei (exceeded max)")
+                logger.info("[GAS] Using stream gas price (capped): %.2f Gwei -> %s Gwei (exceeded max)", stream_gas_price_wei / 1e9, self.max_gas_price_gwei)
                 return max_gas_price
-            print(f"[GAS] Using gas price from STREAM: {stream_gas_price_wei / 1e9:.2f} Gwei")
+            logger.info("[GAS] Using gas price from STREAM: %.2f Gwei", stream_gas_price_wei / 1e9)
             return stream_gas_price_wei
         
         # Priority 2: Use fixed gas price if set
-        if self.gas_price_gwei:
-            fixed_gas_wei = self.w3.to_wei(self.gas_price_gwei, 'gwei')
-            print(f"[GAS] Using FIXED gas price: {self.gas_price_gwei} Gwei ({fixed_gas_wei / 1e9:.2f} Gwei)")
+        if self._fixed_gas_price_wei is not None:
+            fixed_gas_wei = self._fixed_gas_price_wei
+            logger.info("[GAS] Using FIXED gas price: %s Gwei (%.2f Gwei)", self.gas_price_gwei, fixed_gas_wei / 1e9)
             return fixed_gas_wei
         
         # Priority 3: Fetch from network via RPC
         try:
             gas_price = self.w3.eth.gas_price
-            max_gas_price = self.w3.to_wei(self.max_gas_price_gwei, 'gwei')
             if gas_price > max_gas_price:
-                print(f"[GAS] Using RPC gas price (capped): {gas_price / 1e9:.2f} Gwei -> {self.max_gas_price_gwei} Gwei (exceeded max)")
+                logger.info("[GAS] Using RPC gas price (capped): %.2f Gwei -> %s Gwei (exceeded max)", gas_price / 1e9, self.max_gas_price_gwei)
                 return max_gas_price
-            print(f"[GAS] Using gas price from RPC: {gas_price / 1e9:.2f} Gwei")
+            logger.info("[GAS] Using gas price from RPC: %.2f Gwei", gas_price / 1e9)
             return gas_price
         except Exception as e:
             # Fallback to default if gas estimation fails
-            fallback_gas = self.w3.to_wei(30, 'gwei')
-            print(f"[GAS] Using FALLBACK gas price: 30 Gwei (RPC fetch failed: {str(e)})")
-            return fallback_gas
+            logger.warning("[GAS] Using FALLBACK gas price: 30 Gwei (RPC fetch failed: %s)", e)
+            return FALLBACK_GAS_PRICE_WEI
 
 
 def extract_gas_from_stream(pool_event: Dict) -> Optional[int]:
@@ -87,7 +193,7 @@ def extract_gas_from_stream(pool_event: Dict) -> Optional[int]:
     if transaction_header:
         gas_price = transaction_header.get('GasPrice')
         if gas_price is not None and isinstance(gas_price, int):
-            print(f"[GAS] Extracted from stream TransactionHeader.GasPrice: {gas_price / 1e9:.2f} Gwei")
+            logger.info("[GAS] Extracted from stream TransactionHeader.GasPrice: %.2f Gwei", gas_price / 1e9)
             return gas_price
     
     # Fallback to BaseFee from Header (block base fee)
@@ -100,9 +206,9 @@ def extract_gas_from_stream(pool_event: Dict) -> Optional[int]:
             # BaseFee is the base fee per gas, we can use it as gas price
             # For EIP-1559 transactions, actual gas price = baseFee + priorityFee
             # But for legacy transactions, we can use baseFee as minimum
-            print(f"[GAS] Extracted from stream Header.BaseFee: {base_fee / 1e9:.2f} Gwei")
+            logger.info("[GAS] Extracted from stream Header.BaseFee: %.2f Gwei", base_fee / 1e9)
             return base_fee
     
-    print(f"[GAS] No gas price found in stream data, will use fallback (RPC/fixed/default)")
+    logger.info("[GAS] No gas price found in stream data, will use fallback (RPC/fixed/default)")
     return None
 
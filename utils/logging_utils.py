@@ -0,0 +1,39 @@
+"""
+Logging utilities.
+"""
+
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+
+def setup_logging(level: int = logging.INFO) -> QueueListener:
+    """
+    Route root logging through a queue so formatting and I/O run off the caller's thread.
+
+    Records are put on an unbounded queue by a QueueHandler; a QueueListener thread
+    formats them and writes them to stdout. Messages keep their own prefixes
+    (e.g. "  WARNING:"), so the format is the bare message, as with print.
+
+    Args:
+        level: Minimum level to emit
+
+    Returns:
+        The started QueueListener; call stop() on shutdown to flush pending records
+    """
+    log_queue: queue.Queue = queue.Queue(-1)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, QueueHandler):
+            root.removeHandler(handler)
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,95 @@
+"""
+Multicall3 utilities for batching read-only contract calls into one eth_call.
+"""
+
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from web3 import Web3
+
+# Multicall3 is deployed at the same address on mainnet and most EVM chains
+MULTICALL3_ADDRESS = '0xcA11bde05977b3631167028862bE2a173976CA11'
+
+# keccak256("getEthBalance(address)")[:4]
+GET_ETH_BALANCE_SELECTOR = bytes.fromhex('4d2301cc')
+
+MULTICALL3_ABI = [
+    {
+        "inputs": [
+            {
+                "components": [
+                    {"internalType": "address", "name": "target", "type": "address"},
+                    {"internalType": "bool", "name": "allowFailure", "type": "bool"},
+                    {"internalType": "bytes", "name": "callData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Call3[]",
+                "name": "calls",
+                "type": "tuple[]"
+            }
+        ],
+        "name": "aggregate3",
+        "outputs": [
+            {
+                "components": [
+                    {"internalType": "bool", "name": "success", "type": "bool"},
+                    {"internalType": "bytes", "name": "returnData", "type": "bytes"}
+                ],
+                "internalType": "struct Multicall3.Result[]",
+                "name": "returnData",
+                "type": "tuple[]"
+            }
+        ],
+        "stateMutability": "payable",
+        "type": "function"
+    }
+]
+
+
+def aggregate3(w3: 'Web3', calls: List[Tuple[str, bytes]], allow_failure: bool = True) -> List[Tuple[bool, bytes]]:
+    """
+    Execute several read-only calls in a single eth_call through Multicall3.
+
+    Args:
+        w3: Web3 instance
+        calls: List of (target address, calldata) tuples
+        allow_failure: Whether a reverting call is reported instead of reverting the batch
+
+    Returns:
+        List of (success, return data) tuples in the same order as calls
+    """
+    if not calls:
+        return []
+    multicall = w3.eth.contract(address=MULTICALL3_ADDRESS, abi=MULTICALL3_ABI)
+    results = multicall.functions.aggregate3(
+        [(target, allow_failure, call_data) for target, call_data in calls]
+    ).call()
+    return [(success, bytes(return_data)) for success, return_data in results]
+
+
+def encode_get_eth_balance(address: str) -> bytes:
+    """
+    Build Multicall3 getEthBalance(address) calldata.
+    
+    Args:
+        address: Address to query the ETH balance of
+        
+    Returns:
+        ABI-encoded calldata (call it with MULTICALL3_ADDRESS as the target)
+    """
+    return GET_ETH_BALANCE_SELECTOR + bytes.fromhex(address[2:]).rjust(32, b'\x00')
+
+
+def decode_uint256(success: bool, return_data: bytes) -> Optional[int]:
+    """
+    Decode a single uint256 result from aggregate3.
+    
+    Args:
+        success: Whether the call succeeded
+        return_data: Raw return data of the call
+        
+    Returns:
+        The decoded integer, or None if the call failed or returned too little data
+    """
+    if not success or len(return_data) < 32:
+        return None
+    return int.from_bytes(return_data[:32], 'big')
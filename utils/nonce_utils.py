@@ -0,0 +1,47 @@
+"""
+Nonce management utilities.
+"""
+
+import threading
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from web3 import Web3
+
+
+class NonceManager:
+    """Tracks the wallet nonce locally so sends don't need eth_getTransactionCount."""
+
+    def __init__(self, w3: 'Web3', address: str):
+        """
+        Initialize nonce manager.
+
+        The nonce is loaded from the node on first use and after resync().
+
+        Args:
+            w3: Web3 instance
+            address: Wallet address the nonces are tracked for
+        """
+        self.w3 = w3
+        self.address = address
+        self._nonce: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def reserve(self) -> int:
+        """
+        Reserve the next nonce for a transaction about to be sent.
+
+        Returns:
+            Nonce to use
+        """
+        with self._lock:
+            if self._nonce is None:
+                self._nonce = self.w3.eth.get_transaction_count(self.address, 'pending')
+            nonce = self._nonce
+            self._nonce += 1
+            return nonce
+
+    def resync(self):
+        """Reload the nonce from the node on next use (after a failed or unsent transaction)."""
+        with self._lock:
+            self._nonce = None
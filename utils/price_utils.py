@@ -2,7 +2,7 @@
 Price lookup utilities for DEX pool events.
 """
 
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
 
 def get_best_slippage_bps(price_table: Dict, direction: str) -> Optional[int]:
@@ -16,24 +16,16 @@ def get_best_slippage_bps(price_table: Dict, direction: str) -> Optional[int]:
     Returns:
         Best slippage in basis points or None if not found
     """
-    prices_key = f'{direction}Prices'
-    if prices_key not in price_table:
-        return None
-        
-    prices = price_table[prices_key]
-    if not isinstance(prices, list) or len(prices) == 0:
+    prices = price_table.get(f'{direction}Prices')
+    if not isinstance(prices, list):
         return None
     
-    # Find the lowest slippage that has valid price data
-    best_slippage = None
-    for price_entry in prices:
-        if isinstance(price_entry, dict):
-            slippage = price_entry.get('SlippageBasisPoints')
-            if slippage is not None:
-                if best_slippage is None or slippage < best_slippage:
-                    best_slippage = slippage
-    
-    return best_slippage
+    # Lowest slippage that has valid price data
+    return min(
+        (price_entry['SlippageBasisPoints'] for price_entry in prices
+         if isinstance(price_entry, dict) and price_entry.get('SlippageBasisPoints') is not None),
+        default=None
+    )
 
 
 def get_median_slippage_bps(price_table: Dict, direction: str) -> Optional[int]:
@@ -47,29 +39,18 @@ def get_median_slippage_bps(price_table: Dict, direction: str) -> Optional[int]:
     Returns:
         Median slippage in basis points or None if not found
     """
-    prices_key = f'{direction}Prices'
-    if prices_key not in price_table:
-        return None
-        
-    prices = price_table[prices_key]
-    if not isinstance(prices, list) or len(prices) == 0:
+    prices = price_table.get(f'{direction}Prices')
+    if not isinstance(prices, list):
         return None
     
-    # Collect all valid slippage values
-    slippages = []
-    for price_entry in prices:
-        if isinstance(price_entry, dict):
-            slippage = price_entry.get('SlippageBasisPoints')
-            if slippage is not None:
-                slippages.append(slippage)
-    
+    # Extract and sort in one pass; the upper median is always an existing table level
+    slippages = sorted(
+        price_entry['SlippageBasisPoints'] for price_entry in prices
+        if isinstance(price_entry, dict) and price_entry.get('SlippageBasisPoints') is not None
+    )
     if not slippages:
         return None
-    
-    # Sort and get median
-    slippages.sort()
-    median_index = len(slippages) // 2
-    return slippages[median_index]
+    return slippages[len(slippages) // 2]
 
 
 def get_price_for_slippage(price_table: Dict, direction: str, slippage_bps: int) -> Optional[Dict]:
@@ -84,22 +65,16 @@ def get_price_for_slippage(price_table: Dict, direction: str, slippage_bps: int)
     Returns:
         Price entry dict or None if not found
     """
-    prices_key = f'{direction}Prices'
-    if prices_key not in price_table:
-        return None
-        
-    prices = price_table[prices_key]
+    prices = price_table.get(f'{direction}Prices')
     if not isinstance(prices, list):
         return None
-        
-    for price_entry in prices:
-        if isinstance(price_entry, dict) and price_entry.get('SlippageBasisPoints') == slippage_bps:
-            return price_entry
-            
-    # Return first available if exact match not found
-    if prices:
-        return prices[0]
-    return None
+    
+    # Fall back to the first available entry if there is no exact match
+    return next(
+        (price_entry for price_entry in prices
+         if isinstance(price_entry, dict) and price_entry.get('SlippageBasisPoints') == slippage_bps),
+        prices[0] if prices else None
+    )
 
 
 def get_best_direction_by_liquidity(pool_event: Dict, slippage_bps: Optional[int] = None, verbose: bool = True) -> Optional[str]:
@@ -117,6 +92,77 @@ def get_best_direction_by_liquidity(pool_event: Dict, slippage_bps: Optional[int
     Returns:
         'AtoB' or 'BtoA' based on which has more liquidity, or None if cannot determine
     """
+    return _select_direction(pool_event, slippage_bps, verbose, {})
+
+
+def get_best_direction_with_medians(pool_event: Dict, verbose: bool = True) -> Tuple[Optional[str], Dict[str, Optional[int]]]:
+    """
+    Determine the best trade direction and return the median slippages used to pick it.
+    
+    Same decision as get_best_direction_by_liquidity at median slippage, but the
+    per-direction medians computed along the way are returned as well so callers
+    don't walk the price table again to find them.
+    
+    Args:
+        pool_event: Pool event dictionary containing Liquidity and PoolPriceTable
+        verbose: Whether to print detailed decision information
+        
+    Returns:
+        Tuple of (direction or None, {'AtoB': median_bps, 'BtoA': median_bps}).
+        The dict is empty if the event has no liquidity or price table data.
+    """
+    medians: Dict[str, Optional[int]] = {}
+    direction = _select_direction(pool_event, None, verbose, medians)
+    return direction, medians
+
+
+def _median_price_entry(price_table: Dict, direction: str) -> Tuple[Optional[int], Optional[Dict]]:
+    """
+    Get the median slippage and its price entry in one walk of the price list.
+    
+    Equivalent to get_median_slippage_bps followed by get_price_for_slippage at
+    that median, without iterating the list a second time.
+    
+    Args:
+        price_table: PoolPriceTable dictionary
+        direction: 'AtoB' or 'BtoA'
+        
+    Returns:
+        Tuple of (median slippage in basis points, first entry at that slippage),
+        or (None, None) if no entry has a slippage
+    """
+    prices = price_table.get(f'{direction}Prices')
+    if not isinstance(prices, list):
+        return None, None
+    
+    slippages = []
+    first_entries: Dict[int, Dict] = {}
+    for price_entry in prices:
+        if isinstance(price_entry, dict):
+            slippage = price_entry.get('SlippageBasisPoints')
+            if slippage is not None:
+                slippages.append(slippage)
+                first_entries.setdefault(slippage, price_entry)
+    if not slippages:
+        return None, None
+    slippages.sort()
+    median = slippages[len(slippages) // 2]
+    return median, first_entries[median]
+
+
+def _select_direction(pool_event: Dict, slippage_bps: Optional[int], verbose: bool, medians: Dict[str, Optional[int]]) -> Optional[str]:
+    """
+    Shared implementation of the direction decision.
+    
+    Args:
+        pool_event: Pool event dictionary containing Liquidity and PoolPriceTable
+        slippage_bps: Optional slippage level to compare at (None for median)
+        verbose: Whether to print detailed decision information
+        medians: Filled with the median slippage of each direction when computed
+        
+    Returns:
+        'AtoB' or 'BtoA', or None if cannot determine
+    """
     liquidity = pool_event.get('Liquidity', {})
     price_table = pool_event.get('PoolPriceTable', {})
     
@@ -138,9 +184,11 @@ def get_best_direction_by_liquidity(pool_event: Dict, slippage_bps: Optional[int
     btoa_slippage = None
     
     if slippage_bps is None:
-        # Get median slippage for both directions
-        atob_slippage = get_median_slippage_bps(price_table, 'AtoB')
-        btoa_slippage = get_median_slippage_bps(price_table, 'BtoA')
+        # Get median slippage and its price entry for both directions
+        atob_slippage, atob_price = _median_price_entry(price_table, 'AtoB')
+        btoa_slippage, btoa_price = _median_price_entry(price_table, 'BtoA')
+        medians['AtoB'] = atob_slippage
+        medians['BtoA'] = btoa_slippage
         
         if verbose:
             print(f"  Median Slippage - AtoB: {atob_slippage} bps, BtoA: {btoa_slippage} bps")
@@ -151,10 +199,6 @@ def get_best_direction_by_liquidity(pool_event: Dict, slippage_bps: Optional[int
             # Fallback to liquidity amounts
             return _compare_liquidity_amounts(liquidity, verbose=verbose)
         
-        # Use median slippage for each direction separately
-        atob_price = get_price_for_slippage(price_table, 'AtoB', atob_slippage)
-        btoa_price = get_price_for_slippage(price_table, 'BtoA', btoa_slippage)
-        
         if verbose:
             print(f"  Using median slippage for each direction (AtoB: {atob_slippage} bps, BtoA: {btoa_slippage} bps)")
     else:
@@ -173,6 +217,14 @@ def get_best_direction_by_liquidity(pool_event: Dict, slippage_bps: Optional[int
     if verbose:
         print(f"  MaxAmountIn at {display_slippage} bps - AtoB: {atob_max}, BtoA: {btoa_max}")
     
+    # Only one direction has price data: it is the only one a trade can be priced in
+    if (atob_max is None) != (btoa_max is None):
+        direction = 'AtoB' if btoa_max is None else 'BtoA'
+        if verbose:
+            print(f"  Method: Only {direction} has price data")
+            print(f"  Decision: {direction}")
+        return direction
+    
     # If we have MaxAmountIn values, use them
     if atob_max is not None and btoa_max is not None:
         # Compare as numbers (they should be integers after conversion)
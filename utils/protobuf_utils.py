@@ -2,107 +2,239 @@
 Protobuf conversion utilities for Bitquery stream messages.
 """
 
-import base58
-from typing import Dict
+from base58 import b58encode
+from typing import Dict, Optional
 from google.protobuf.descriptor import FieldDescriptor
 
 
+# Fields whose values are hex-encoded numbers (bytes in the protobuf schema)
+NUMERIC_HEX_FIELDS = frozenset({
+    'Number', 'BaseFee', 'ParentNumber', 'PreBalance', 'PostBalance',
+    'MaxAmountIn', 'MaxAmountOut', 'MinAmountOut', 'MinAmountIn',
+    'AmountCurrencyA', 'AmountCurrencyB', 'GasPrice', 'GasFeeCap', 'GasTipCap'
+})
+
+# Fields that should be numeric but might come as strings (decimal or hex)
+NUMERIC_FIELDS = frozenset({
+    'SlippageBasisPoints', 'Price', 'AtoBPrice', 'BtoAPrice'
+})
+
+
+def _parse_hex_first(value: str):
+    """Parse a string as hex, falling back to decimal; return it unchanged if neither works."""
+    try:
+        return int(value, 16)
+    except ValueError:
+        try:
+            if '.' in value:
+                return float(value)
+            return int(value)
+        except ValueError:
+            return value
+
+
+def _parse_decimal_first(value: str):
+    """Parse a string as decimal, falling back to hex; return it unchanged if neither works."""
+    try:
+        if '.' in value:
+            return float(value)
+        return int(value)
+    except ValueError:
+        try:
+            return int(value, 16)
+        except ValueError:
+            return value
+
+
+def _bytes_to_base58(value):
+    """Encode bytes as a base58 string."""
+    return b58encode(value).decode('ascii')
+
+
+def _bytes_to_hex(value):
+    """Encode bytes as a 0x-prefixed hex string."""
+    return '0x' + value.hex()
+
+
 def convert_bytes(value, encoding='base58'):
     """Convert bytes to string representation."""
     if encoding == 'base58':
-        return base58.b58encode(value).decode()
-    return '0x' + value.hex()
+        return _bytes_to_base58(value)
+    return _bytes_to_hex(value)
+
+
+# Field kinds in a decode plan
+_SCALAR, _BYTES, _MESSAGE, _REPEATED_SCALAR, _REPEATED_BYTES, _REPEATED_MESSAGE = range(6)
+
+# Decode plans per message descriptor: ([(name, kind, oneof_name), ...], {name: entry})
+_PLAN_CACHE: Dict = {}
+
+
+def _field_plan(descriptor):
+    """
+    Get the decode plan for a message type, building it on first use.
+    
+    The plan resolves each field's label, type and oneof once, so decoding a
+    message is a loop over tuples instead of descriptor attribute lookups for
+    every field of every message.
+    
+    Args:
+        descriptor: Protobuf message descriptor
+        
+    Returns:
+        Tuple of (list of (name, kind, oneof_name) entries, dict of entries by name)
+    """
+    plan = _PLAN_CACHE.get(descriptor)
+    if plan is None:
+        entries = []
+        for field in descriptor.fields:
+            if field.type == FieldDescriptor.TYPE_MESSAGE:
+                kind = _MESSAGE
+            elif field.type == FieldDescriptor.TYPE_BYTES:
+                kind = _BYTES
+            else:
+                kind = _SCALAR
+            if field.label == FieldDescriptor.LABEL_REPEATED:
+                kind += _REPEATED_SCALAR
+                oneof_name = None
+            else:
+                oneof_name = field.containing_oneof.name if field.containing_oneof else None
+            entries.append((field.name, kind, oneof_name))
+        plan = (entries, {entry[0]: entry for entry in entries})
+        _PLAN_CACHE[descriptor] = plan
+    return plan
 
 
 def protobuf_to_dict(msg, encoding='base58'):
     """Convert protobuf message to dictionary."""
+    bytes_to_str = _bytes_to_base58 if encoding == 'base58' else _bytes_to_hex
     result = {}
-    for field in msg.DESCRIPTOR.fields:
-        value = getattr(msg, field.name)
+    for name, kind, oneof_name in _field_plan(msg.DESCRIPTOR)[0]:
+        value = getattr(msg, name)
 
-        if field.label == FieldDescriptor.LABEL_REPEATED:
+        if kind >= _REPEATED_SCALAR:
             if not value:
                 continue
-            result[field.name] = []
-            for item in value:
-                if field.type == FieldDescriptor.TYPE_MESSAGE:
-                    result[field.name].append(protobuf_to_dict(item, encoding))
-                elif field.type == FieldDescriptor.TYPE_BYTES:
-                    result[field.name].append(convert_bytes(item, encoding))
+            if kind == _REPEATED_MESSAGE:
+                result[name] = [protobuf_to_dict(item, encoding) for item in value]
+            elif kind == _REPEATED_BYTES:
+                result[name] = [bytes_to_str(item) for item in value]
+            else:
+                result[name] = list(value)
+
+        elif oneof_name is not None:
+            if msg.WhichOneof(oneof_name) == name:
+                if kind == _MESSAGE:
+                    result[name] = protobuf_to_dict(value, encoding)
+                elif kind == _BYTES:
+                    result[name] = bytes_to_str(value)
                 else:
-                    result[field.name].append(item)
-
-        elif field.containing_oneof:
-            if msg.WhichOneof(field.containing_oneof.name) == field.name:
-                if field.type == FieldDescriptor.TYPE_MESSAGE:
-                    result[field.name] = protobuf_to_dict(value, encoding)
-                elif field.type == FieldDescriptor.TYPE_BYTES:
-                    result[field.name] = convert_bytes(value, encoding)
+                    result[name] = value
+
+        elif kind == _MESSAGE:
+            if msg.HasField(name):
+                result[name] = protobuf_to_dict(value, encoding)
+
+        elif kind == _BYTES:
+            result[name] = bytes_to_str(value)
+
+        else:
+            result[name] = value
+
+    return result
+
+
+def _bytes_to_int_field(name, value):
+    """Convert a bytes field the way hex encoding followed by convert_hex_to_int would."""
+    if value and name in NUMERIC_HEX_FIELDS:
+        return int.from_bytes(value, 'big')
+    return '0x' + value.hex()
+
+
+def _scalar_to_int_field(name, value):
+    """Convert a scalar field the way convert_hex_to_int would."""
+    if isinstance(value, str) and value:
+        if name in NUMERIC_HEX_FIELDS:
+            return _parse_hex_first(value)
+        if name in NUMERIC_FIELDS:
+            return _parse_decimal_first(value)
+    return value
+
+
+def protobuf_to_dict_int(msg, fields: Optional[Dict] = None):
+    """
+    Convert protobuf message to dictionary with numeric fields already parsed.
+    
+    Produces the same result as convert_hex_to_int(protobuf_to_dict(msg, 'hex'))
+    in a single traversal: numeric bytes fields become ints straight from the
+    raw bytes instead of going through an intermediate hex string.
+    
+    Args:
+        msg: Protobuf message
+        fields: Optional field spec limiting what is decoded. Maps field names to
+            a nested spec for message fields, or None to decode the field fully.
+            Fields not listed are skipped. None decodes every field.
+    """
+    entries, entries_by_name = _field_plan(msg.DESCRIPTOR)
+    if fields is not None:
+        entries = [entries_by_name[name] for name in fields if name in entries_by_name]
+    
+    result = {}
+    for name, kind, oneof_name in entries:
+        value = getattr(msg, name)
+        sub_fields = fields.get(name) if fields is not None else None
+
+        if kind >= _REPEATED_SCALAR:
+            if not value:
+                continue
+            if kind == _REPEATED_MESSAGE:
+                result[name] = [protobuf_to_dict_int(item, sub_fields) for item in value]
+            elif kind == _REPEATED_BYTES:
+                result[name] = ['0x' + item.hex() for item in value]
+            else:
+                result[name] = list(value)
+
+        elif oneof_name is not None:
+            if msg.WhichOneof(oneof_name) == name:
+                if kind == _MESSAGE:
+                    result[name] = protobuf_to_dict_int(value, sub_fields)
+                elif kind == _BYTES:
+                    result[name] = _bytes_to_int_field(name, value)
                 else:
-                    result[field.name] = value
+                    result[name] = _scalar_to_int_field(name, value)
 
-        elif field.type == FieldDescriptor.TYPE_MESSAGE:
-            if msg.HasField(field.name):
-                result[field.name] = protobuf_to_dict(value, encoding)
+        elif kind == _MESSAGE:
+            if msg.HasField(name):
+                result[name] = protobuf_to_dict_int(value, sub_fields)
 
-        elif field.type == FieldDescriptor.TYPE_BYTES:
-            result[field.name] = convert_bytes(value, encoding)
+        elif kind == _BYTES:
+            result[name] = _bytes_to_int_field(name, value)
 
         else:
-            result[field.name] = value
+            result[name] = _scalar_to_int_field(name, value)
 
     return result
 
 
 def convert_hex_to_int(data):
-    """Recursively convert hex strings to integers/floats for known numeric fields."""
-    numeric_hex_fields = {
-        'Number', 'BaseFee', 'ParentNumber', 'PreBalance', 'PostBalance',
-        'MaxAmountIn', 'MaxAmountOut', 'MinAmountOut', 'MinAmountIn',
-        'AmountCurrencyA', 'AmountCurrencyB', 'GasPrice', 'GasFeeCap', 'GasTipCap'
-    }
-    
-    # Fields that should be numeric but might come as strings (decimal or hex)
-    numeric_fields = {
-        'SlippageBasisPoints', 'Price', 'AtoBPrice', 'BtoAPrice'
-    }
+    """
+    Recursively convert hex strings to integers/floats for known numeric fields.
     
+    Dicts and lists are converted in place (no copy of every container is made)
+    and the same object is returned.
+    """
     if isinstance(data, dict):
-        result = {}
         for key, value in data.items():
-            if key in numeric_hex_fields and isinstance(value, str) and value:
-                # Try hex conversion first
-                try:
-                    result[key] = int(value, 16)
-                except ValueError:
-                    # Try decimal conversion
-                    try:
-                        if '.' in value:
-                            result[key] = float(value)
-                        else:
-                            result[key] = int(value)
-                    except ValueError:
-                        result[key] = value
-            elif key in numeric_fields and isinstance(value, str) and value:
-                # For numeric fields, try decimal first, then hex
-                try:
-                    if '.' in value:
-                        result[key] = float(value)
-                    else:
-                        result[key] = int(value)
-                except ValueError:
-                    # Try hex as fallback
-                    try:
-                        result[key] = int(value, 16)
-                    except ValueError:
-                        result[key] = value
+            if isinstance(value, str):
+                if value:
+                    if key in NUMERIC_HEX_FIELDS:
+                        data[key] = _parse_hex_first(value)
+                    elif key in NUMERIC_FIELDS:
+                        data[key] = _parse_decimal_first(value)
             elif isinstance(value, (dict, list)):
-                result[key] = convert_hex_to_int(value)
-            else:
-                result[key] = value
-        return result
+                convert_hex_to_int(value)
     elif isinstance(data, list):
-        return [convert_hex_to_int(item) for item in data]
-    else:
-        return data
-
+        for item in data:
+            if isinstance(item, (dict, list)):
+                convert_hex_to_int(item)
+    return data
@@ -2,15 +2,79 @@
 Token utilities for address extraction and validation.
 """
 
-from typing import Dict, Optional, TYPE_CHECKING
-from eth_utils import to_checksum_address
-from decimal import Decimal
+import logging
+from functools import lru_cache
+from typing import Dict, List, Optional, TYPE_CHECKING
+from utils.address_utils import address_bytes, checksum_address, is_hex_address
+from utils.conversion_utils import convert_amount_from_smallest_unit
+from utils.multicall_utils import MULTICALL3_ADDRESS, aggregate3, decode_uint256, encode_get_eth_balance
 
 if TYPE_CHECKING:
     from web3 import Web3
+    from utils.balance_utils import AllowanceCache, PreTradeState
+
+logger = logging.getLogger(__name__)
 
 # Common token addresses
 WETH_ADDRESS = '0xC02aaA39b223FE8D0A0e5C4F27eAD9083C756Cc2'
+_WETH_BYTES = address_bytes(WETH_ADDRESS)
+
+# keccak256("balanceOf(address)")[:4]
+BALANCE_OF_SELECTOR = bytes.fromhex('70a08231')
+# keccak256("allowance(address,address)")[:4]
+ALLOWANCE_SELECTOR = bytes.fromhex('dd62ed3e')
+# keccak256("approve(address,uint256)")[:4]
+APPROVE_SELECTOR = bytes.fromhex('095ea7b3')
+
+# Amount used for approvals, so a token is only approved once per router
+MAX_UINT256 = 2**256 - 1
+
+# Gas limit for approval transactions
+APPROVE_GAS = 150000
+
+# Standard ERC20 functions used for approvals and balance reads
+ERC20_ABI = [
+    {
+        "inputs": [
+            {"internalType": "address", "name": "spender", "type": "address"},
+            {"internalType": "uint256", "name": "amount", "type": "uint256"}
+        ],
+        "name": "approve",
+        "outputs": [{"internalType": "bool", "name": "", "type": "bool"}],
+        "stateMutability": "nonpayable",
+        "type": "function"
+    },
+    {
+        "inputs": [
+            {"internalType": "address", "name": "owner", "type": "address"},
+            {"internalType": "address", "name": "spender", "type": "address"}
+        ],
+        "name": "allowance",
+        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    },
+    {
+        "inputs": [{"internalType": "address", "name": "account", "type": "address"}],
+        "name": "balanceOf",
+        "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
+        "stateMutability": "view",
+        "type": "function"
+    }
+]
+
+
+def is_weth(address: str) -> bool:
+    """
+    Check whether an address is WETH, ignoring case.
+    
+    Args:
+        address: Hex address (any case, with 0x prefix)
+        
+    Returns:
+        True if the address is WETH_ADDRESS
+    """
+    return address_bytes(address) == _WETH_BYTES
 
 
 def get_token_address(currency_info: Dict) -> Optional[str]:
@@ -24,15 +88,9 @@ def get_token_address(currency_info: Dict) -> Optional[str]:
         Checksummed token address or None if invalid
     """
     address = currency_info.get('SmartContract') 
-    if not address or address == '0x':
+    if not address or not is_hex_address(address):
         return None
-    
-    if address.startswith('0x'):
-        try:
-            return to_checksum_address(address)
-        except:
-            return None
-    return None
+    return checksum_address(address)
 
 
 def get_token_balance(token_info: Dict, w3: 'Web3', address: str) -> Optional[float]:
@@ -53,53 +111,124 @@ def get_token_balance(token_info: Dict, w3: 'Web3', address: str) -> Optional[fl
             return None
         
         decimals = int(token_info.get('Decimals', 18))
-        token_abi = get_token_abi()
-        token_contract = w3.eth.contract(
-            address=token_address,
-            abi=token_abi
-        )
+        token_contract = get_token_contract(w3, token_address)
         balance_wei = token_contract.functions.balanceOf(address).call()
-        return float(Decimal(balance_wei) / (Decimal(10) ** decimals))
+        return convert_amount_from_smallest_unit(balance_wei, decimals)
     except Exception:
         return None
 
 
+def encode_balance_of(owner: str) -> bytes:
+    """
+    Build balanceOf(owner) calldata.
+    
+    Args:
+        owner: Address to query the balance of
+        
+    Returns:
+        ABI-encoded calldata (selector followed by the left-padded address)
+    """
+    return BALANCE_OF_SELECTOR + bytes.fromhex(owner[2:]).rjust(32, b'\x00')
+
+
+def encode_allowance(owner: str, spender: str) -> bytes:
+    """
+    Build allowance(owner, spender) calldata.
+    
+    Args:
+        owner: Token owner address
+        spender: Approved spender address
+        
+    Returns:
+        ABI-encoded calldata (selector followed by the two left-padded addresses)
+    """
+    return (ALLOWANCE_SELECTOR
+            + bytes.fromhex(owner[2:]).rjust(32, b'\x00')
+            + bytes.fromhex(spender[2:]).rjust(32, b'\x00'))
+
+
+@lru_cache(maxsize=64)
+def encode_max_approve(spender: str) -> bytes:
+    """
+    Build approve(spender, MAX_UINT256) calldata, memoized per spender.
+    
+    Args:
+        spender: Address to approve
+        
+    Returns:
+        ABI-encoded calldata (selector, left-padded address, all-ones amount)
+    """
+    return (APPROVE_SELECTOR
+            + bytes.fromhex(spender[2:]).rjust(32, b'\x00')
+            + MAX_UINT256.to_bytes(32, 'big'))
+
+
+def get_token_balances_multi(tokens: List[Dict], w3: 'Web3', owner: str) -> List[Optional[float]]:
+    """
+    Get the balances of several tokens for one address in a single RPC call.
+    
+    The balanceOf calls are batched through Multicall3. If the multicall itself
+    fails, balances are fetched one by one with get_token_balance.
+    
+    Args:
+        tokens: Currency dictionaries with 'SmartContract' and 'Decimals' fields
+        w3: Web3 instance
+        owner: Wallet address to check balances for
+        
+    Returns:
+        Token balances (human-readable, adjusted for decimals) in the same order as
+        tokens; None for tokens whose balance could not be fetched
+    """
+    balances: List[Optional[float]] = [None] * len(tokens)
+    calls = []
+    indexes = []
+    call_data = encode_balance_of(owner)
+    for i, token_info in enumerate(tokens):
+        token_address = get_token_address(token_info)
+        if token_address:
+            calls.append((token_address, call_data))
+            indexes.append(i)
+    
+    try:
+        results = aggregate3(w3, calls)
+    except Exception:
+        return [get_token_balance(token_info, w3, owner) for token_info in tokens]
+    
+    for i, (success, return_data) in zip(indexes, results):
+        balance_wei = decode_uint256(success, return_data)
+        if balance_wei is None:
+            continue
+        try:
+            decimals = int(tokens[i].get('Decimals', 18))
+        except (TypeError, ValueError):
+            continue
+        balances[i] = convert_amount_from_smallest_unit(balance_wei, decimals)
+    return balances
+
+
 def get_token_abi():
     """
     Get standard ERC20 token ABI for common operations.
     
     Returns:
-        List of ABI entries for approve, allowance, and balanceOf
-    """
-    return [
-        {
-            "inputs": [
-                {"internalType": "address", "name": "spender", "type": "address"},
-                {"internalType": "uint256", "name": "amount", "type": "uint256"}
-            ],
-            "name": "approve",
-            "outputs": [{"internalType": "bool", "name": "", "type": "bool"}],
-            "stateMutability": "nonpayable",
-            "type": "function"
-        },
-        {
-            "inputs": [
-                {"internalType": "address", "name": "owner", "type": "address"},
-                {"internalType": "address", "name": "spender", "type": "address"}
-            ],
-            "name": "allowance",
-            "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
-            "stateMutability": "view",
-            "type": "function"
-        },
-        {
-            "inputs": [{"internalType": "address", "name": "account", "type": "address"}],
-            "name": "balanceOf",
-            "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
-            "stateMutability": "view",
-            "type": "function"
-        }
-    ]
+        List of ABI entries for approve, allowance, and balanceOf (shared; do not modify)
+    """
+    return ERC20_ABI
+
+
+@lru_cache(maxsize=512)
+def get_token_contract(w3: 'Web3', token_address: str):
+    """
+    Get an ERC20 contract object, built once per (Web3 instance, token).
+    
+    Args:
+        w3: Web3 instance
+        token_address: Checksummed token address
+        
+    Returns:
+        Contract with the ERC20_ABI functions
+    """
+    return w3.eth.contract(address=token_address, abi=ERC20_ABI)
 
 
 def check_and_approve_token(
@@ -110,11 +239,17 @@ def check_and_approve_token(
     account,
     address: str,
     gas_manager,
-    stream_gas_price_wei: Optional[int] = None
+    stream_gas_price_wei: Optional[int] = None,
+    state: Optional['PreTradeState'] = None,
+    allowance_cache: Optional['AllowanceCache'] = None,
+    chain_id: Optional[int] = None
 ) -> bool:
     """
     Check token balance and approve if needed.
     
+    Without a pre-fetched state, the token balance, ETH balance and allowance
+    are read together in one Multicall3 call.
+    
     Args:
         token_address: Token contract address
         router_address: Router contract address to approve
@@ -124,20 +259,48 @@ def check_and_approve_token(
         address: Wallet address
         gas_manager: GasManager instance
         stream_gas_price_wei: Gas price from stream in Wei (optional)
+        state: Pre-fetched wallet state (optional). Values it holds are used instead
+            of reading them again, and the approval takes its nonce from it.
+        allowance_cache: AllowanceCache to take the allowance from and record
+            reads and confirmed approvals in (optional)
+        chain_id: Chain ID for the approval transaction (optional, read from the node if not given)
         
     Returns:
         True if approved or already has sufficient allowance, False otherwise
     """
     print(f"  Checking token balance for address: {token_address}")
-    token_abi = get_token_abi()
-    token_contract = w3.eth.contract(
-        address=to_checksum_address(token_address),
-        abi=token_abi
-    )
+    token = checksum_address(token_address)
+    token_contract = get_token_contract(w3, token)
+    
+    token_balance = None
+    balance_wei = None
+    allowance = None
+    if state is not None:
+        token_balance = state.token_balance
+        balance_wei = state.eth_balance
+        allowance = state.allowance
+    if allowance is None and allowance_cache is not None:
+        allowance = allowance_cache.get(token_address, router_address)
+    read_allowance = allowance is None
+    if state is None:
+        # Read the token balance, ETH balance and (uncached) allowance in one eth_call;
+        # any value the multicall cannot return is read on its own below
+        calls = [(token, encode_balance_of(address)), (MULTICALL3_ADDRESS, encode_get_eth_balance(address))]
+        if read_allowance:
+            calls.append((token, encode_allowance(address, router_address)))
+        try:
+            results = aggregate3(w3, calls)
+            token_balance = decode_uint256(*results[0])
+            balance_wei = decode_uint256(*results[1])
+            if read_allowance:
+                allowance = decode_uint256(*results[2])
+        except Exception as e:
+            logger.warning("  WARNING: Multicall3 read failed (%s), reading balances separately", e)
     
     # Check token balance
     try:
-        token_balance = token_contract.functions.balanceOf(address).call()
+        if token_balance is None:
+            token_balance = token_contract.functions.balanceOf(address).call()
         if token_balance < amount:
             print(f"  WARNING: Insufficient token balance. Need {amount}, have {token_balance}")
             print(f"  Token Address: {token_address}")
@@ -147,26 +310,43 @@ def check_and_approve_token(
         return False
     
     # Check ETH balance for gas fees
-    gas_price = gas_manager.get_gas_price(stream_gas_price_wei=stream_gas_price_wei)
-    balance_wei = w3.eth.get_balance(address)
+    if state is not None:
+        gas_price = state.gas_price
+    else:
+        gas_price = gas_manager.get_gas_price(stream_gas_price_wei=stream_gas_price_wei)
+    if balance_wei is None:
+        balance_wei = w3.eth.get_balance(address)
     estimated_gas_cost = gas_price * 300000
     if balance_wei < estimated_gas_cost:
         print(f"  WARNING: Insufficient ETH for gas fees. Need {w3.from_wei(estimated_gas_cost, 'ether'):.6f} ETH, have {w3.from_wei(balance_wei, 'ether'):.6f} ETH")
         return False
     
     # Check and approve if needed
-    allowance = token_contract.functions.allowance(address, router_address).call()
+    if allowance is None:
+        allowance = token_contract.functions.allowance(address, router_address).call()
+    if read_allowance and allowance_cache is not None:
+        allowance_cache.set(token_address, router_address, allowance)
     if allowance < amount:
-        nonce = w3.eth.get_transaction_count(address)
-        approve_txn = token_contract.functions.approve(
-            router_address,
-            2**256 - 1  # Max approval
-        ).build_transaction({
+        if state is not None:
+            nonce = state.next_nonce()
+        else:
+            nonce = w3.eth.get_transaction_count(address)
+        # Built directly from the cached calldata; build_transaction would ABI-encode it again
+        approve_txn = {
             'from': address,
-            'gas': 150000,
-            'gasPrice': gas_price,
-            'nonce': nonce
-        })
+            'to': token,
+            'data': encode_max_approve(router_address),
+            'value': 0,
+            'gas': APPROVE_GAS,
+            'nonce': nonce,
+            'chainId': w3.eth.chain_id if chain_id is None else chain_id
+        }
+        if state is not None and state.max_priority_fee is not None:
+            approve_txn['type'] = 2
+            approve_txn['maxFeePerGas'] = gas_price
+            approve_txn['maxPriorityFeePerGas'] = state.max_priority_fee
+        else:
+            approve_txn['gasPrice'] = gas_price
         
         signed_approve = account.sign_transaction(approve_txn)
         approve_tx_hash = w3.eth.send_raw_transaction(signed_approve.raw_transaction)
@@ -177,6 +357,8 @@ def check_and_approve_token(
         if receipt.status != 1:
             print(f"  ERROR: Approval transaction failed")
             return False
+        if allowance_cache is not None:
+            allowance_cache.set(token_address, router_address, MAX_UINT256)
         print(f"  Approval confirmed, proceeding with swap...")
     
     return True
@@ -2,14 +2,230 @@
 Transaction utilities for calculating actual amounts received and transaction results.
 """
 
-from typing import Dict, Optional, TYPE_CHECKING
-from decimal import Decimal
-from eth_utils import to_checksum_address
+import logging
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+from utils.address_utils import address_bytes, checksum_address
 
 if TYPE_CHECKING:
     from web3 import Web3
 
-from utils.token_utils import WETH_ADDRESS
+from utils.conversion_utils import convert_amount_from_smallest_unit
+from utils.token_utils import encode_balance_of, is_weth
+
+logger = logging.getLogger(__name__)
+
+# keccak256("Transfer(address,address,uint256)")
+TRANSFER_TOPIC = bytes.fromhex('ddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef')
+# keccak256("Withdrawal(address,uint256)"), emitted by WETH when it is unwrapped
+WITHDRAWAL_TOPIC = bytes.fromhex('7fcf532c15f0a6db0bd6d0e038bea71d30d808c7d98cb3bf7268a95bf5081b65')
+
+# Balances at mined blocks, keyed by (token bytes, or b'' for ETH, wallet bytes, block number).
+# The key is a block number, and the head block can still be replaced by a reorg, so only
+# balances at least one block behind the head are stored; entries are only evicted.
+BALANCE_CACHE_SIZE = 1024
+_block_balances: 'OrderedDict[Tuple[bytes, bytes, int], int]' = OrderedDict()
+_block_balances_lock = threading.Lock()
+
+# Where a reported amount out came from
+AMOUNT_MEASURED = 'measured'  # Read from the logs or balances
+AMOUNT_FALLBACK_ERROR = 'fallback_error'  # Expected amount; the measurement failed
+AMOUNT_FALLBACK_LOW = 'fallback_low'  # Expected amount; the measured amount was implausibly low
+
+
+def _amount_received_from_logs(logs, token_out_address: str, address: str, is_eth_out: bool) -> Optional[int]:
+    """
+    Get the amount a swap delivered to the wallet from its receipt logs.
+    
+    Sums the output token's Transfer events to the wallet. For ETH output
+    without such a transfer (the router unwrapped WETH and sent plain ETH, which
+    emits no event), sums WETH's Withdrawal events instead: in our own swap
+    transaction the only unwrap is the router's for our output.
+    
+    Args:
+        logs: Receipt logs
+        token_out_address: Output token address
+        address: Wallet address
+        is_eth_out: Whether the output token is WETH
+        
+    Returns:
+        Amount in the token's smallest unit, or None if the logs don't show it
+    """
+    token = address_bytes(token_out_address)
+    recipient_topic = bytes(12) + address_bytes(address)
+    transferred = None
+    withdrawn = None
+    for log in logs:
+        topics = log['topics']
+        if not topics or address_bytes(log['address']) != token:
+            continue
+        # Topics are HexBytes, a bytes subclass, so they compare against bytes directly
+        topic = topics[0]
+        if topic == TRANSFER_TOPIC:
+            if len(topics) == 3 and topics[2] == recipient_topic:
+                transferred = (transferred or 0) + int.from_bytes(log['data'], 'big')
+        elif topic == WITHDRAWAL_TOPIC and is_eth_out:
+            withdrawn = (withdrawn or 0) + int.from_bytes(log['data'], 'big')
+    return transferred if transferred is not None else withdrawn
+
+
+def _decode_balance(return_data: bytes) -> int:
+    """Decode balanceOf return data, rejecting an empty result (no contract at the address)."""
+    if len(return_data) < 32:
+        raise ValueError('balanceOf returned no data')
+    return int.from_bytes(return_data[:32], 'big')
+
+
+def _balance_reads(receipt, token_out_address: str, w3: 'Web3', address: str, is_eth_out: bool) -> List[Tuple]:
+    """
+    Describe the two balance reads that measure a swap's output.
+    
+    The balance after the swap is read at the receipt's block hash when it has
+    one (EIP-1898), so a reorged block fails instead of returning another
+    block's state. The balance before it is read at the end of the previous block.
+    
+    Args:
+        receipt: Transaction receipt
+        token_out_address: Output token address
+        w3: Web3 instance
+        address: Wallet address
+        is_eth_out: Whether the output is ETH (read with eth_getBalance)
+        
+    Returns:
+        [after, before] reads, each (cache key, block identifier, request function, decoder)
+    """
+    block_number = receipt.blockNumber
+    block_hash = receipt.get('blockHash')
+    if is_eth_out:
+        owner = (b'', address_bytes(address))
+        request = lambda block: w3.eth.get_balance(address, block_identifier=block)
+        decode: Callable = int
+    else:
+        # A raw eth_call passes a block hash straight to the node; a contract
+        # function call would first look the block up to get its number
+        owner = (address_bytes(token_out_address), address_bytes(address))
+        balance_of = {'to': checksum_address(token_out_address), 'data': encode_balance_of(address)}
+        request = lambda block: w3.eth.call(balance_of, block_identifier=block)
+        decode = _decode_balance
+    return [
+        (owner + (block_number,), block_number if block_hash is None else block_hash, request, decode),
+        (owner + (block_number - 1,), block_number - 1, request, decode)
+    ]
+
+
+def _read_block_balances(w3: 'Web3', reads: List[Tuple], head_block: Optional[int] = None) -> List[int]:
+    """
+    Perform balance reads, sending the ones not cached as one JSON-RPC batch.
+    
+    Balances already read for a block (e.g. the previous block's balance by a
+    trade mined in it) are served from the cache, and reads with the same key
+    are sent once. Falls back to separate requests if the provider rejects batches.
+    Fresh balances are only cached for blocks behind the head, which is taken
+    to be the newest block read when head_block is not known or older.
+    
+    Args:
+        w3: Web3 instance
+        reads: Reads as returned by _balance_reads
+        head_block: Latest block number known to the caller (optional)
+        
+    Returns:
+        Balances in the order of reads
+    """
+    with _block_balances_lock:
+        balances = [_block_balances.get(read[0]) for read in reads]
+    missing: Dict[Tuple, Tuple] = {}
+    for read, balance in zip(reads, balances):
+        if balance is None:
+            missing.setdefault(read[0], read)
+    if not missing:
+        return balances
+    
+    requests = list(missing.values())
+    if len(requests) == 1:
+        results = [requests[0][2](requests[0][1])]
+    else:
+        try:
+            with w3.batch_requests() as batch:
+                for _, identifier, request, _ in requests:
+                    batch.add(request(identifier))
+                results = list(batch.execute())
+        except Exception as e:
+            logger.warning("  WARNING: Batch RPC failed (%s), reading balances separately", e)
+            results = [request(identifier) for _, identifier, request, _ in requests]
+    
+    fresh = {key: decode(result) for (key, _, _, decode), result in zip(requests, results)}
+    newest_block = max(read[0][2] for read in reads)
+    head = newest_block if head_block is None else max(head_block, newest_block)
+    with _block_balances_lock:
+        for key, balance in fresh.items():
+            if key[2] >= head:
+                continue
+            _block_balances[key] = balance
+            _block_balances.move_to_end(key)
+        while len(_block_balances) > BALANCE_CACHE_SIZE:
+            _block_balances.popitem(last=False)
+    return [fresh[read[0]] if balance is None else balance for read, balance in zip(reads, balances)]
+
+
+def _amount_from_balances(receipt, is_eth_out: bool, balance_after: int, balance_before: int) -> int:
+    """Get the amount a swap delivered from the balances around its block."""
+    if is_eth_out:
+        # Add back the gas cost, which was deducted from the same balance
+        return balance_after - balance_before + receipt.gasUsed * receipt.effectiveGasPrice
+    return balance_after - balance_before
+
+
+def _validated_amount_out(amount_out_wei: int, decimals_out: int, expected_out: float) -> Tuple[float, str]:
+    """Convert a measured amount, falling back to the expected amount if it is implausible."""
+    actual_amount_out = convert_amount_from_smallest_unit(amount_out_wei, decimals_out)
+    # Validate the calculated amount - should be positive and reasonable
+    if actual_amount_out <= 0:
+        # If calculation returned invalid value, use expected amount
+        return float(expected_out), AMOUNT_FALLBACK_LOW
+    if actual_amount_out < float(expected_out) * 0.5:
+        # If actual is less than 50% of expected, something is wrong - use expected
+        return float(expected_out), AMOUNT_FALLBACK_LOW
+    return actual_amount_out, AMOUNT_MEASURED
+
+
+def calculate_actual_amount_out_wei(
+    receipt,
+    token_out_address: str,
+    w3: 'Web3',
+    address: str,
+    head_block: Optional[int] = None
+) -> int:
+    """
+    Calculate the exact amount received from a swap transaction.
+    
+    The amount is read from the receipt's logs when they show it; otherwise the
+    wallet balance is compared before and after the transaction's block.
+    
+    Args:
+        receipt: Transaction receipt
+        token_out_address: Output token address
+        w3: Web3 instance
+        address: Wallet address
+        head_block: Latest block number, so balances of older blocks can be cached (optional)
+        
+    Returns:
+        Amount received in the output token's smallest unit
+        
+    Raises:
+        Exception: If the balances cannot be read from the node
+    """
+    is_eth_out = is_weth(token_out_address)
+    
+    received_wei = _amount_received_from_logs(receipt.get('logs') or (), token_out_address, address, is_eth_out)
+    if received_wei is not None:
+        # The swap's own Transfer/Withdrawal events carry the amount; no balance reads needed
+        return received_wei
+    
+    balance_after, balance_before = _read_block_balances(
+        w3, _balance_reads(receipt, token_out_address, w3, address, is_eth_out), head_block
+    )
+    return _amount_from_balances(receipt, is_eth_out, balance_after, balance_before)
 
 
 def calculate_actual_amount_out(
@@ -18,11 +234,17 @@ def calculate_actual_amount_out(
     decimals_out: int,
     w3: 'Web3',
     address: str,
-    expected_out: float
-) -> float:
+    expected_out: float,
+    head_block: Optional[int] = None
+) -> Tuple[float, str]:
     """
     Calculate actual amount received from a swap transaction.
     
+    Human-readable wrapper around calculate_actual_amount_out_wei that falls
+    back to the expected amount when the result is missing or implausible. The
+    returned source tells a measured amount from either fallback, so callers
+    can reconcile fallbacks instead of trusting them.
+    
     Args:
         receipt: Transaction receipt
         token_out_address: Output token address
@@ -30,55 +252,73 @@ def calculate_actual_amount_out(
         w3: Web3 instance
         address: Wallet address
         expected_out: Expected output amount (fallback if calculation fails)
+        head_block: Latest block number, so balances of older blocks can be cached (optional)
         
     Returns:
-        Actual amount received as float
+        Tuple of (amount received as float, source: AMOUNT_MEASURED,
+        AMOUNT_FALLBACK_ERROR or AMOUNT_FALLBACK_LOW)
     """
-    actual_amount_out = None
-    
-    # Check if output token is ETH/WETH
-    is_eth_out = token_out_address.lower() == WETH_ADDRESS.lower()
-    
     try:
-        if is_eth_out:
-            # For ETH/WETH, check ETH balance change
-            balance_after = w3.eth.get_balance(address, block_identifier=receipt.blockNumber)
-            balance_before = w3.eth.get_balance(address, block_identifier=receipt.blockNumber - 1)
-            actual_amount_out_wei = balance_after - balance_before
-            # Subtract gas cost (approximate)
-            gas_cost = receipt.gasUsed * receipt.effectiveGasPrice
-            actual_amount_out_wei = actual_amount_out_wei + gas_cost  # Add back gas since it was deducted
-            actual_amount_out = float(Decimal(actual_amount_out_wei) / (Decimal(10) ** decimals_out))
-        else:
-            # For ERC20 tokens, check token balance
-            token_out_contract = w3.eth.contract(
-                address=to_checksum_address(token_out_address),
-                abi=[{
-                    "inputs": [{"internalType": "address", "name": "account", "type": "address"}],
-                    "name": "balanceOf",
-                    "outputs": [{"internalType": "uint256", "name": "", "type": "uint256"}],
-                    "stateMutability": "view",
-                    "type": "function"
-                }]
-            )
-            # Get balance after swap
-            balance_after = token_out_contract.functions.balanceOf(address).call(block_identifier=receipt.blockNumber)
-            # Get balance before swap (from block before the transaction)
-            block_before = receipt.blockNumber - 1
-            balance_before = token_out_contract.functions.balanceOf(address).call(block_identifier=block_before)
-            actual_amount_out_wei = balance_after - balance_before
-            actual_amount_out = float(Decimal(actual_amount_out_wei) / (Decimal(10) ** decimals_out))
-        
-        # Validate the calculated amount - should be positive and reasonable
-        if actual_amount_out is None or actual_amount_out <= 0:
-            # If calculation failed or returned invalid value, use expected amount
-            actual_amount_out = float(expected_out)
-        elif actual_amount_out < float(expected_out) * 0.5:
-            # If actual is less than 50% of expected, something is wrong - use expected
-            actual_amount_out = float(expected_out)
+        actual_amount_out_wei = calculate_actual_amount_out_wei(receipt, token_out_address, w3, address, head_block)
+        return _validated_amount_out(actual_amount_out_wei, decimals_out, expected_out)
     except Exception as e:
         # If we can't get actual amount, fall back to expected
-        print(f"  WARNING: Error calculating actual amount: {str(e)}, using expected amount")
-        actual_amount_out = float(expected_out)
+        logger.warning("  WARNING: Error calculating actual amount: %s, using expected amount", e)
+        return float(expected_out), AMOUNT_FALLBACK_ERROR
+
+
+def calculate_actual_amount_out_batch(
+    items: List[Tuple],
+    w3: 'Web3',
+    address: str,
+    head_block: Optional[int] = None
+) -> List[Tuple[float, str]]:
+    """
+    Calculate actual amounts received for several swap transactions at once.
     
-    return actual_amount_out
+    Same result as calculate_actual_amount_out for each item, but the balance
+    reads of all swaps whose logs don't show the amount are sent as a single
+    JSON-RPC batch, with reads shared between swaps made once.
+    
+    Args:
+        items: List of (receipt, token_out_address, decimals_out, expected_out) tuples
+        w3: Web3 instance
+        address: Wallet address
+        head_block: Latest block number, so balances of older blocks can be cached (optional)
+        
+    Returns:
+        (amount received, source) tuples as returned by calculate_actual_amount_out,
+        in the order of items
+    """
+    received: List[Optional[int]] = []
+    reads: List[Tuple] = []
+    failed = set()
+    for i, (receipt, token_out_address, _, _) in enumerate(items):
+        try:
+            is_eth_out = is_weth(token_out_address)
+            amount = _amount_received_from_logs(receipt.get('logs') or (), token_out_address, address, is_eth_out)
+            if amount is None:
+                reads.extend(_balance_reads(receipt, token_out_address, w3, address, is_eth_out))
+        except Exception as e:
+            logger.warning("  WARNING: Error calculating actual amount: %s, using expected amount", e)
+            amount = None
+            failed.add(i)
+        received.append(amount)
+    
+    balances = None
+    if reads:
+        try:
+            balances = iter(_read_block_balances(w3, reads, head_block))
+        except Exception as e:
+            logger.warning("  WARNING: Error calculating actual amounts: %s, using expected amounts", e)
+    
+    amounts_out = []
+    for i, ((receipt, token_out_address, decimals_out, expected_out), amount) in enumerate(zip(items, received)):
+        if amount is None and i not in failed and balances is not None:
+            balance_after, balance_before = next(balances), next(balances)
+            amount = _amount_from_balances(receipt, is_weth(token_out_address), balance_after, balance_before)
+        if amount is None:
+            amounts_out.append((float(expected_out), AMOUNT_FALLBACK_ERROR))
+        else:
+            amounts_out.append(_validated_amount_out(amount, decimals_out, expected_out))
+    return amounts_out